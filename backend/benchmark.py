@@ -0,0 +1,215 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_llm import FakeChatModel
+from cache import intent_cache, qa_cache
+from checkpoint import SpillStore
+from fast_intent import FastIntentClassifier
+from instrumentation import Instrumentation
+from prompts import SECTIONS, prefix_cache
+from reservations import ReservationStore
+from server import SessionServer
+from speculation import Speculation
+
+# Offline benchmark: replays scripted guest conversations through the
+# intent.py / intent_and_functions.py routing with FakeChatModel standing in
+# for ChatOpenAI, and prints one JSON line per (flow, concurrency) run.
+#
+#   python benchmark.py --sessions 1 10 100 1000 --output bench.jsonl
+#
+# With --spill every session is checkpointed to disk after each reply, as if
+# the guest went idle, and rebuilt on its next message.
+
+SCRIPTS = {
+    'booking': ["Hi, I'd like to book a table for 4 on Friday", "Alice", "Yes please"],
+    'edit': ["I need to change my reservation", "It's under Alice for Friday", "Can you move it to Saturday?"],
+    'cancel': ["Please cancel my booking", "It's under Bob, on the 12th", "Thanks"],
+    'qa': ["What time do you open?", "Do you have vegan options?"],
+}
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # peak rather than current RSS, in KiB on Linux and bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_flow(name):
+    if name == 'functions':
+        import intent_and_functions as flow
+    else:
+        import intent as flow
+    return flow
+
+
+def cold_start(flow_name, latency):
+    # in a fresh interpreter: this one has already imported everything
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'registry.py')
+    return subprocess.run([sys.executable, script, '--flow', flow_name, '--latency', str(latency)],
+                          capture_output=True, text=True, check=True).stdout.strip()
+
+
+async def run_session(dispatcher, script, latencies):
+    for message in script:
+        started = time.perf_counter()
+        await dispatcher.handle(message)
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_spilled_session(server, session_id, script, latencies, resumes):
+    for message in script:
+        started = time.perf_counter()
+        if session_id in server.spill:
+            server.session(session_id)
+            resumes.append(time.perf_counter() - started)
+        await server.handle(session_id, message)
+        latencies.append(time.perf_counter() - started)
+        server.spill_session(session_id)
+
+
+async def run(flow_name, sessions, llm, capacity, instrument=False, spill_path=None, speculate=False):
+    flow = load_flow(flow_name)
+    # the functions flow books through a module-level store; give every run a fresh one
+    if hasattr(flow, 'reservations'):
+        flow.reservations = ReservationStore(capacity=capacity)
+    classifier = FastIntentClassifier()
+    instrumentation = Instrumentation() if instrument else None
+    speculation = Speculation() if speculate else None
+    llm.stats.reset()
+    intent_cache.clear()
+    qa_cache.clear()
+    prefix_cache.clear()
+
+    rss_before = rss_bytes()
+    scripts = [SCRIPTS[name] for name in SCRIPTS]
+    latencies = []
+    resumes = []
+    if spill_path is None:
+        dispatchers = [flow.build_dispatcher(llm, classifier, instrumentation=instrumentation, speculation=speculation)
+                       for _ in range(sessions)]
+        started = time.perf_counter()
+        await asyncio.gather(*(run_session(dispatcher, scripts[i % len(scripts)], latencies)
+                               for i, dispatcher in enumerate(dispatchers)))
+    else:
+        spill = SpillStore(spill_path)
+        server = SessionServer(lambda: flow.build_dispatcher(llm, classifier, instrumentation=instrumentation,
+                                                             speculation=speculation),
+                               spill=spill)
+        started = time.perf_counter()
+        await asyncio.gather(*(run_spilled_session(server, i, scripts[i % len(scripts)], latencies, resumes)
+                               for i in range(sessions)))
+    elapsed = time.perf_counter() - started
+    rss_after = rss_bytes()
+
+    turns = len(latencies)
+    result = {
+        'flow': flow_name,
+        'sessions': sessions,
+        'turns': turns,
+        'elapsed_s': round(elapsed, 4),
+        'turns_per_s': round(turns / elapsed, 2),
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'latency_p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'llm_calls_per_turn': round(llm.stats.calls / turns, 3),
+        'prompt_tokens_per_turn': round(llm.stats.prompt_tokens / turns, 1),
+        'rss_per_session_kb': round(max(rss_after - rss_before, 0) / sessions / 1024, 1),
+        'intent_hit_rate': classifier.stats()['hit_rate'],
+        'intent_cache_hit_rate': intent_cache.stats()['hit_rate'],
+        'qa_cache_hit_rate': qa_cache.stats()['hit_rate'],
+        'instrumented': instrument,
+        'spilled': spill_path is not None,
+    }
+    if instrumentation is not None:
+        sections = {key[0][1]: value for key, value in instrumentation.metrics.prompt_section_tokens.values.items()}
+        result.update({f'{section}_prompt_tokens_per_turn': round(sections.get(section, 0) / turns, 1)
+                       for section in SECTIONS})
+        result['prefix_cache_hit_rate'] = prefix_cache.stats()['hit_rate']
+    if speculation is not None:
+        stats = speculation.stats()
+        result.update({
+            'speculation_hit_rate': stats['hit_rate'],
+            'speculations_per_turn': round(stats['speculations'] / turns, 3),
+            'wasted_tokens_per_turn': round((stats['wasted_prompt_tokens'] + stats['wasted_completion_tokens'])
+                                            / turns, 1),
+        })
+    if spill_path is not None:
+        result.update({
+            'spilled_bytes_per_session': round(spill.bytes() / sessions, 1),
+            'resume_p50_ms': round(percentile(resumes, 50) * 1000, 3) if resumes else None,
+            'resume_p95_ms': round(percentile(resumes, 95) * 1000, 3) if resumes else None,
+        })
+        spill.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline bookit benchmark with a scripted fake LLM")
+    parser.add_argument('--flow', choices=['functions', 'intent', 'both'], default='both')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per fake LLM call")
+    parser.add_argument('--token-latency', type=float, default=0.0, help="seconds per fake completion token")
+    parser.add_argument('--completion-tokens', type=int, default=20)
+    parser.add_argument('--capacity', type=int, default=10 ** 6, help="seats per date for the run")
+    parser.add_argument('--instrument', action='store_true', help="run with per-turn instrumentation enabled")
+    parser.add_argument('--spill', action='store_true',
+                        help="checkpoint sessions to disk after every reply and measure resume latency")
+    parser.add_argument('--speculate', action='store_true',
+                        help="start the likely branch while the intent LLM decides, report hit rate and waste")
+    parser.add_argument('--cold-start', action='store_true',
+                        help="also time a cold start (imports, first dispatcher, first turn) of each flow")
+    parser.add_argument('--output', help="append JSON lines to this file instead of stdout")
+    args = parser.parse_args()
+
+    llm = FakeChatModel(latency=args.latency, token_latency=args.token_latency,
+                        completion_tokens=args.completion_tokens)
+    flows = ['intent', 'functions'] if args.flow == 'both' else [args.flow]
+    revision = git_revision()
+    out = open(args.output, 'a') if args.output else sys.stdout
+    spill_dir = tempfile.TemporaryDirectory() if args.spill else None
+    try:
+        for flow_name in flows:
+            if args.cold_start:
+                out.write(cold_start(flow_name, args.latency) + '\n')
+            for sessions in args.sessions:
+                spill_path = os.path.join(spill_dir.name, f"{flow_name}-{sessions}.db") if spill_dir else None
+                result = asyncio.run(run(flow_name, sessions, llm, args.capacity, args.instrument, spill_path,
+                                         args.speculate))
+                result['revision'] = revision
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if spill_dir is not None:
+            spill_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
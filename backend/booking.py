@@ -0,0 +1,272 @@
+import datetime
+
+from slots import ambiguous_slots, confirmation, describe_slots, extract_slots
+from speculation import commit_point
+
+
+def date_argument(date):
+    # the tools take the date as a YYYYMMDD integer
+    return date.year * 10000 + date.month * 100 + date.day
+
+
+class BookingFlow:
+    """New-reservation branch that fills slots locally and calls the tools directly.
+
+    Party size, date and name are extracted from each guest message and
+    accumulated over the conversation. Availability and booking go straight
+    to `availability_tool` / `reservation_tool` (validated by their args
+    schemas), and `conversation` phrases the reply with the tool result in its
+    `available_seats` input. Nothing is booked until the guest has confirmed
+    the party size, date and name the bot read back to them; a bare word is
+    only taken as a name right after the bot asked for one. A completed
+    booking is confirmed from a template. Messages the extractor cannot pin
+    down go to `agent` with the details known so far, and the exchange is
+    saved to the conversation memory. When the date is full,
+    `alternatives_tool` supplies the nearest dates to propose.
+    Dates are relative to `current_date`, today's date unless one is given.
+    """
+
+    def __init__(self, conversation, agent, availability_tool, reservation_tool, current_date=None,
+                 alternatives_tool=None):
+        self.conversation = conversation
+        self.agent = agent
+        self.availability_tool = availability_tool
+        self.reservation_tool = reservation_tool
+        self.alternatives_tool = alternatives_tool
+        self.pinned_date = current_date
+        self.slots = {}
+        # what the last reply asked for: 'name', or the (date, seats, name) read back for confirmation
+        self.asked = None
+
+    @property
+    def current_date(self):
+        # read on every message, so sessions open over midnight move to the new day
+        return self.pinned_date or datetime.date.today()
+
+    def state(self):
+        """What the flow remembers besides `slots`, as JSON values; empty when there is nothing."""
+        if isinstance(self.asked, tuple):
+            date, seats, name = self.asked
+            return {"asked": [date.isoformat(), seats, name]}
+        return {"asked": self.asked} if self.asked else {}
+
+    def restore(self, state):
+        """Put back a `state()`; an empty one resets the flow's fields."""
+        asked = state.get("asked")
+        if isinstance(asked, list):
+            date, seats, name = asked
+            asked = (datetime.date.fromisoformat(date), seats, name)
+        self.asked = asked
+
+    async def __call__(self, query, callbacks=None):
+        asked, self.asked = self.asked, None
+        found = extract_slots(query, self.current_date, expect_name=asked == 'name')
+        unclear = ambiguous_slots(query, self.current_date)
+        self.slots.update({key: value for key, value in found.items() if key not in unclear})
+        if unclear:
+            return await self._ask_agent(query, callbacks)
+
+        if 'date' not in self.slots or 'seats' not in self.slots:
+            return await self._reply(query, "", callbacks)
+
+        date, seats = self.slots['date'], self.slots['seats']
+        if date < self.current_date:
+            del self.slots['date']
+            return await self._reply(query, f"({date:%A %B %d} is in the past, ask for another date)", callbacks)
+
+        available = await self.availability_tool.arun({"date": date_argument(date)}, callbacks=callbacks)
+        if available < seats:
+            del self.slots['date']
+            return await self._reply(
+                query, f"(only {available} seats left on {date:%A %B %d}, {seats} needed: "
+                       f"{await self._alternatives(date, seats, callbacks)})", callbacks)
+        if 'name' not in self.slots:
+            self.asked = 'name'
+            return await self._reply(
+                query, f"({available} seats available on {date:%A %B %d}: ask for the name)", callbacks)
+
+        name = self.slots['name']
+        details = (date, seats, name)
+        answer = confirmation(query) if asked == details else None
+        if answer is not True:
+            self.asked = details
+            if answer is False:
+                return await self._reply(
+                    query, f"(the guest did not confirm {seats} people on {date:%A %B %d} under {name}: "
+                           f"ask what to change)", callbacks)
+            return await self._reply(
+                query, f"({available} seats available on {date:%A %B %d}: read back {seats} people on "
+                       f"{date:%A %B %d} under the name {name} and ask the guest to confirm)", callbacks)
+
+        # a speculative run stops here until the intent is confirmed
+        await commit_point()
+        booked = await self.reservation_tool.arun(
+            {"date": date_argument(date), "seats": seats, "name": name}, callbacks=callbacks)
+        if not booked:
+            del self.slots['date']
+            return await self._reply(
+                query, f"(booking {seats} seats on {date:%A %B %d} failed, the date just filled up: "
+                       f"{await self._alternatives(date, seats, callbacks)})", callbacks)
+
+        self.slots = {}
+        reply = f"You're all set, {name}: a table for {seats} on {date:%A %B %d}. See you then!"
+        self.conversation.memory.save_context({"question": query}, {"text": reply})
+        return reply
+
+    async def _ask_agent(self, query, callbacks):
+        # the agent is shared and has no memory: give it what this guest said so far
+        known = describe_slots(self.slots)
+        reply = await self.agent.arun(f"{known}\n{query}" if known else query, callbacks=callbacks)
+        self.conversation.memory.save_context({"question": query}, {"text": reply})
+        return reply
+
+    async def _alternatives(self, date, seats, callbacks):
+        if self.alternatives_tool is None:
+            return "propose another date"
+        dates = await self.alternatives_tool.arun({"date": date_argument(date), "seats": seats}, callbacks=callbacks)
+        if not dates:
+            return "no other date is available"
+        days = ", ".join(f"{datetime.date.fromisoformat(d):%A %B %d}" for d in dates)
+        return f"propose one of these dates instead: {days}"
+
+    async def _reply(self, query, available_seats, callbacks):
+        return await self.conversation.arun(
+            {"question": query, "available_seats": available_seats}, callbacks=callbacks)
+
+
+class ChangeFlow:
+    """Edit or cancel branch: finds the guest's reservation and calls `change_tool` directly.
+
+    The reservation is looked up with `find_tool` from the name and date the
+    guest gives; for an edit, a date or party size given once it is found is
+    the change. As in BookingFlow, nothing is changed until the guest has
+    confirmed what the bot read back, and `conversation` phrases the other
+    replies with the situation in its `details` input.
+    """
+
+    def __init__(self, action, conversation, find_tool, change_tool, current_date=None):
+        self.action = action
+        self.conversation = conversation
+        self.find_tool = find_tool
+        self.change_tool = change_tool
+        self.pinned_date = current_date
+        # name and date of the reservation looked for (also filled by carried-over slots)
+        self.slots = {}
+        self.seats = None
+        self.changes = {}
+        self.asked = None
+
+    @property
+    def current_date(self):
+        return self.pinned_date or datetime.date.today()
+
+    def state(self):
+        """What the flow remembers besides `slots`, as JSON values; empty when there is nothing."""
+        state = {}
+        if self.seats is not None:
+            state["seats"] = self.seats
+        if self.changes:
+            state["changes"] = {key: value.isoformat() if key == 'date' else value
+                                for key, value in self.changes.items()}
+        if isinstance(self.asked, tuple):
+            name, date, new_date, seats = self.asked
+            state["asked"] = [name, date.isoformat(), new_date.isoformat(), seats]
+        elif self.asked:
+            state["asked"] = self.asked
+        return state
+
+    def restore(self, state):
+        """Put back a `state()`; an empty one resets the flow's fields."""
+        self.seats = state.get("seats")
+        self.changes = {key: datetime.date.fromisoformat(value) if key == 'date' else value
+                        for key, value in state.get("changes", {}).items()}
+        asked = state.get("asked")
+        if isinstance(asked, list):
+            name, date, new_date, seats = asked
+            asked = (name, datetime.date.fromisoformat(date), datetime.date.fromisoformat(new_date), seats)
+        self.asked = asked
+
+    def _reset(self):
+        self.slots = {}
+        self.seats = None
+        self.changes = {}
+
+    async def __call__(self, query, callbacks=None):
+        asked, self.asked = self.asked, None
+        found = extract_slots(query, self.current_date, expect_name=asked == 'name')
+        if ambiguous_slots(query, self.current_date):
+            return await self._reply(query, "(ask for one exact date and party size)", callbacks)
+
+        if self.seats is None:
+            self.slots.update(found)
+            if 'name' not in self.slots:
+                self.asked = 'name'
+                return await self._reply(query, "(ask for the name and date of the reservation)", callbacks)
+            if 'date' not in self.slots:
+                return await self._reply(query, "(ask for the date of the reservation)", callbacks)
+            name, date = self.slots['name'], self.slots['date']
+            self.seats = await self.find_tool.arun({"name": name, "date": date_argument(date)}, callbacks=callbacks)
+            if not self.seats:
+                self.seats = None
+                del self.slots['date']
+                # the guest may correct the name as well
+                self.asked = 'name'
+                return await self._reply(
+                    query, f"(no reservation under {name} on {date:%A %B %d}: double check the name and date)",
+                    callbacks)
+            if self.action == 'edit':
+                if found.get('seats', self.seats) != self.seats:
+                    self.changes['seats'] = found['seats']
+                if not self.changes:
+                    return await self._reply(
+                        query, f"(found {self.seats} people on {date:%A %B %d} under {name}: "
+                               f"ask what to change)", callbacks)
+        elif self.action == 'edit':
+            self.changes.update({key: found[key] for key in ('date', 'seats') if key in found})
+            if not self.changes:
+                return await self._reply(query, "(ask for the new date or party size)", callbacks)
+
+        name, date = self.slots['name'], self.slots['date']
+        new_date, seats = self.changes.get('date', date), self.changes.get('seats', self.seats)
+        if new_date < self.current_date:
+            del self.changes['date']
+            return await self._reply(query, f"({new_date:%A %B %d} is in the past, ask for another date)",
+                                     callbacks)
+        details = (name, date, new_date, seats)
+        answer = confirmation(query) if asked == details else None
+        if answer is not True:
+            self.asked = details
+            if self.action == 'cancel':
+                summary = f"cancel {seats} people on {date:%A %B %d} under {name}"
+            else:
+                summary = f"change {name}'s reservation to {seats} people on {new_date:%A %B %d}"
+            if answer is False:
+                return await self._reply(query, f"(the guest did not confirm to {summary}: ask what to change)",
+                                         callbacks)
+            return await self._reply(query, f"(read back: {summary}, and ask the guest to confirm)", callbacks)
+
+        # a speculative run stops here until the intent is confirmed
+        await commit_point()
+        if self.action == 'cancel':
+            done = await self.change_tool.arun({"name": name, "date": date_argument(date)}, callbacks=callbacks)
+            reply = f"Your reservation for {seats} on {date:%A %B %d} under {name} is cancelled."
+        else:
+            done = await self.change_tool.arun(
+                {"name": name, "date": date_argument(date), "new_date": date_argument(new_date), "seats": seats},
+                callbacks=callbacks)
+            reply = f"All done, {name}: your table is now for {seats} on {new_date:%A %B %d}."
+        if not done and self.action == 'cancel':
+            self._reset()
+            return await self._reply(
+                query, f"(the reservation under {name} on {date:%A %B %d} is not there anymore)", callbacks)
+        if not done:
+            self.changes.pop('date', None)
+            return await self._reply(
+                query, f"(not possible, {new_date:%A %B %d} has no room for {seats}: ask for another date)",
+                callbacks)
+        self._reset()
+        self.conversation.memory.save_context({"question": query}, {"text": reply})
+        return reply
+
+    async def _reply(self, query, details, callbacks):
+        return await self.conversation.arun({"question": query, "details": details}, callbacks=callbacks)
@@ -0,0 +1,108 @@
+import re
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# Process-wide caches for answers that do not depend on the conversation:
+# intent decisions from the LLM for a session's opening message and answers
+# to general restaurant questions.
+
+# words that do not change what a message asks for
+_FILLER_WORDS = {'hi', 'hello', 'hey', 'please', 'pls', 'thanks', 'thank', 'you', 'ok', 'okay',
+                 'so', 'um', 'uh', 'just', 'there', 'a', 'an', 'the'}
+_NON_WORD = re.compile(r"[^a-z0-9 ]+")
+MAX_KEY_LENGTH = 200
+
+
+def normalize_text(text):
+    """Cache key for a guest message: case, accents, punctuation and filler words removed."""
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().lower()
+    text = _NON_WORD.sub(' ', text.replace("'", ""))
+    return " ".join(word for word in text.split() if word not in _FILLER_WORDS)[:MAX_KEY_LENGTH]
+
+
+class ResponseCache:
+    """Thread-safe LRU cache with a time-to-live and a memory bound.
+
+    Keys are normalized with `normalize_text`. Entries expire `ttl` seconds
+    after they are stored, and the least recently used ones are evicted once
+    there are more than `max_entries` or their size passes `max_bytes`.
+    """
+
+    def __init__(self, max_entries=1000, ttl=3600, max_bytes=1 << 20):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, text):
+        key = normalize_text(text)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < now:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, text, value):
+        key = normalize_text(text)
+        if not key:
+            return
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        """Drop every entry and reset the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self._entries), 'bytes': self.bytes, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0}
+
+
+intent_cache = ResponseCache(max_entries=10000, ttl=24 * 3600)
+qa_cache = ResponseCache(max_entries=2000, ttl=3600)
+
+
+def cached_reply(cache, reply):
+    """Wrap an async `reply(query, callbacks=None)` so repeated questions are answered from `cache`."""
+    async def run(query, callbacks=None):
+        answer = cache.get(query)
+        if answer is None:
+            answer = await reply(query, callbacks=callbacks)
+            cache.put(query, answer)
+        return answer
+    return run
@@ -0,0 +1,98 @@
+import datetime
+import threading
+
+# two years of evenings from the day the calendar is created
+DEFAULT_HORIZON_DAYS = 730
+
+
+class CapacityCalendar:
+    """Free seats per date in a max segment tree, for nearest-alternative searches.
+
+    `set_free` updates one date in O(log n); `nearest` returns the k dates
+    closest to a target that still have at least `seats` free in O(k log n).
+    Dates outside [start, start + horizon_days) are not tracked. Slots are plain
+    integer offsets, so finer time slots only need a different slot mapping.
+    """
+
+    def __init__(self, capacity, start=None, horizon_days=DEFAULT_HORIZON_DAYS):
+        self.start = start or datetime.date.today()
+        self.days = horizon_days
+        self.size = 1
+        while self.size < horizon_days:
+            self.size *= 2
+        # leaves past the horizon hold -1 so no search ever selects them
+        self.tree = [-1] * (2 * self.size)
+        for i in range(horizon_days):
+            self.tree[self.size + i] = capacity
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+        self._lock = threading.Lock()
+
+    def _index(self, date):
+        index = (date - self.start).days
+        return index if 0 <= index < self.days else None
+
+    def free(self, date):
+        index = self._index(date)
+        return None if index is None else self.tree[self.size + index]
+
+    def set_free(self, date, free):
+        index = self._index(date)
+        if index is None:
+            return
+        with self._lock:
+            node = self.size + index
+            self.tree[node] = free
+            node //= 2
+            while node:
+                self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+                node //= 2
+
+    def _first_from(self, node, lo, hi, index, seats):
+        # first slot >= index with at least `seats` free, or -1
+        if hi <= index or self.tree[node] < seats:
+            return -1
+        if hi - lo == 1:
+            return lo
+        mid = (lo + hi) // 2
+        found = self._first_from(2 * node, lo, mid, index, seats)
+        return found if found != -1 else self._first_from(2 * node + 1, mid, hi, index, seats)
+
+    def _last_until(self, node, lo, hi, index, seats):
+        # last slot <= index with at least `seats` free, or -1
+        if lo > index or self.tree[node] < seats:
+            return -1
+        if hi - lo == 1:
+            return lo
+        mid = (lo + hi) // 2
+        found = self._last_until(2 * node + 1, mid, hi, index, seats)
+        return found if found != -1 else self._last_until(2 * node, lo, mid, index, seats)
+
+    def nearest(self, date, seats, k=3, earliest=None):
+        """The `k` dates closest to `date` with at least `seats` free, nearest first.
+
+        Dates before `earliest` (default today) are never proposed; ties go to
+        the later date.
+        """
+        earliest = earliest or datetime.date.today()
+        low = max((earliest - self.start).days, 0)
+        target = min(max((date - self.start).days, low), self.days - 1)
+
+        def first_after(index):
+            return self._first_from(1, 0, self.size, index, seats)
+
+        def last_before(index):
+            found = self._last_until(1, 0, self.size, index, seats)
+            return found if found >= low else -1
+
+        results = []
+        with self._lock:
+            after, before = first_after(target), last_before(target - 1)
+            while len(results) < k and (after != -1 or before != -1):
+                if before == -1 or (after != -1 and after - target <= target - before):
+                    results.append(after)
+                    after = first_after(after + 1)
+                else:
+                    results.append(before)
+                    before = last_before(before - 1)
+        return [self.start + datetime.timedelta(days=index) for index in results]
@@ -0,0 +1,134 @@
+import datetime
+import json
+import sqlite3
+import threading
+import zlib
+
+from langchain.schema.messages import AIMessage, FunctionMessage, HumanMessage, SystemMessage
+
+from memory import TokenBudgetMemory
+
+# Compact snapshots of a guest session, so idle sessions can leave RAM: the
+# current intent, the slots gathered by the branches, the rest of the state of
+# branches that have one (`state()` / `restore()`) and every chat memory,
+# as zlib-compressed JSON with one short array per message. Chains, agents and
+# prompts are not saved; the session is rebuilt by the dispatcher factory and
+# the snapshot restored into it.
+
+STATE_VERSION = 1
+_MESSAGE_TYPES = {HumanMessage: "h", AIMessage: "a", SystemMessage: "s", FunctionMessage: "f"}
+_MESSAGE_CLASSES = {code: cls for cls, code in _MESSAGE_TYPES.items()}
+
+
+def _pack_message(message):
+    row = [_MESSAGE_TYPES[type(message)], message.content]
+    if isinstance(message, FunctionMessage):
+        row.append(message.name)
+    elif message.additional_kwargs:
+        row.append(message.additional_kwargs)
+    return row
+
+
+def _unpack_message(row):
+    cls = _MESSAGE_CLASSES[row[0]]
+    if cls is FunctionMessage:
+        return FunctionMessage(content=row[1], name=row[2])
+    return cls(content=row[1], additional_kwargs=row[2] if len(row) > 2 else {})
+
+
+def _pack_slots(slots):
+    return {key: value.isoformat() if key == 'date' else value for key, value in slots.items()}
+
+
+def _unpack_slots(slots):
+    return {key: datetime.date.fromisoformat(value) if key == 'date' else value for key, value in slots.items()}
+
+
+def session_state(dispatcher):
+    """Snapshot of what a SessionDispatcher remembers about its guest."""
+    memories = {}
+    for memory in dispatcher.memories:
+        entry = {"m": [_pack_message(message) for message in memory.chat_memory.messages]}
+        if isinstance(memory, TokenBudgetMemory) and memory.slots:
+            entry["s"] = _pack_slots(memory.slots)
+        memories[memory.memory_key] = entry
+    branches = {intent: _pack_slots(branch.slots) for intent, branch in dispatcher.branches.items()
+                if getattr(branch, 'slots', None)}
+    flows = {intent: state for intent, state in
+             ((intent, branch.state()) for intent, branch in dispatcher.branches.items() if hasattr(branch, 'state'))
+             if state}
+    return {"v": STATE_VERSION, "intent": dispatcher.intent, "branches": branches, "flows": flows,
+            "memories": memories}
+
+
+def restore_session(dispatcher, state):
+    """Load a `session_state` snapshot into a freshly built dispatcher."""
+    if state.get("v") != STATE_VERSION:
+        raise ValueError(f"unsupported session state version {state.get('v')!r}")
+    dispatcher.intent = state["intent"]
+    for intent, branch in dispatcher.branches.items():
+        if hasattr(branch, 'slots'):
+            branch.slots = _unpack_slots(state["branches"].get(intent, {}))
+        if hasattr(branch, 'restore'):
+            branch.restore(state.get("flows", {}).get(intent, {}))
+    for memory in dispatcher.memories:
+        entry = state["memories"].get(memory.memory_key)
+        if entry is None:
+            continue
+        memory.chat_memory.messages = [_unpack_message(row) for row in entry["m"]]
+        if isinstance(memory, TokenBudgetMemory):
+            memory.slots = _unpack_slots(entry.get("s", {}))
+            memory.token_counts = [memory.token_counter(m.content) for m in memory.chat_memory.messages]
+            memory.total_tokens = sum(memory.token_counts)
+
+
+def encode_state(state) -> bytes:
+    return zlib.compress(json.dumps(state, separators=(",", ":")).encode())
+
+
+def decode_state(data: bytes):
+    return json.loads(zlib.decompress(data))
+
+
+class SpillStore:
+    """On-disk key/value store of encoded session states (SQLite, one row per session).
+
+    The default ':memory:' keeps the compressed states in process, which
+    already saves most of the RAM of a live session.
+    """
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, state BLOB NOT NULL)")
+        self._lock = threading.Lock()
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM sessions WHERE id = ?", (str(session_id),)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM sessions").fetchone()[0]
+
+    def put(self, session_id, data: bytes):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO sessions (id, state) VALUES (?, ?)", (str(session_id), data))
+
+    def pop(self, session_id):
+        """Remove and return the encoded state of `session_id`, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM sessions WHERE id = ?", (str(session_id),)).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM sessions WHERE id = ?", (str(session_id),))
+        return row[0] if row else None
+
+    def bytes(self):
+        with self._lock:
+            return self._conn.execute("SELECT coalesce(sum(length(state)), 0) FROM sessions").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
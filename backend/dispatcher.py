@@ -0,0 +1,157 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+from fast_intent import IntentPrediction, classify_intent
+from memory import memory_tokens
+from routing import carry_slots
+from speculation import SpeculativeRun, speculation_guess
+from streaming import TokenStream
+
+FALLBACK_REPLY = "I can help you book, change or cancel a reservation. What would you like to do?"
+
+
+class Turn(NamedTuple):
+    intent: str
+    reply: str
+    # seconds from the start of the turn to the first streamed token
+    time_to_first_token: Optional[float] = None
+
+
+class SessionDispatcher:
+    """Per-session intent routing, the async form of the scripts' `match intent:` loop.
+
+    A message is classified when no branch is active; it then goes to that
+    branch, and later messages stay there. Intents without a branch (QA,
+    Unclear) are answered by `qa` (QA only) or get `fallback_reply`, and the
+    next message is classified again. `intent_cache` holds LLM intent
+    decisions for repeated opening messages.
+    `branches` maps an intent to an async callable taking the guest message
+    and a `callbacks` list for the branch's LLM calls.
+
+    With an `instrumentation`, each turn is traced (intent source, LLM and
+    tool calls, size of `memories`); without one nothing is recorded.
+
+    With a `speculation` (speculation.Speculation), a message the local
+    classifier is unsure about starts its guessed branch while the intent
+    LLM runs; the branch's reply is used only if the LLM agrees.
+
+    With a `switch_detector` (routing.TopicSwitchDetector), messages to an
+    active branch that look like a change of topic are classified again by
+    the intent LLM. A new branch intent switches branches, carrying over the
+    slots collected so far; a QA question is answered without leaving the
+    branch. Without one, a branch is kept for the rest of the session.
+    """
+
+    def __init__(self, intent_chain, branches: Dict[str, Callable[..., Awaitable[str]]],
+                 classifier=None, fallback_reply=FALLBACK_REPLY, instrumentation=None,
+                 memories=(), session_id=None, qa=None, intent_cache=None, speculation=None,
+                 switch_detector=None):
+        self.intent_chain = intent_chain
+        self.branches = branches
+        self.classifier = classifier
+        self.qa = qa
+        self.intent_cache = intent_cache
+        self.speculation = speculation
+        self.switch_detector = switch_detector
+        self.fallback_reply = fallback_reply
+        self.instrumentation = instrumentation
+        self.memories = list(memories)
+        self.session_id = session_id
+        self.intent: Optional[str] = None
+        self.last_turn: Optional[Turn] = None
+
+    async def classify(self, query, callbacks=None) -> IntentPrediction:
+        return await classify_intent(query, self.intent_chain, self.classifier, self.intent_cache, callbacks)
+
+    async def recheck(self, query, callbacks=None) -> Tuple[str, str]:
+        """Ask the intent LLM about a suspected topic switch.
+
+        Returns the outcome ('switch', 'aside' or 'stay') and the intent to
+        answer this turn with.
+
+        The local classifier and the intent cache are skipped: neither sees the
+        conversation, and a message like "make it 6 people instead" only makes
+        sense with it. The intent LLM does, through its history, which also
+        records the messages that stayed in the branch.
+        """
+        prediction = await classify_intent(query, self.intent_chain, callbacks=callbacks)
+        intent = prediction.intent
+        if intent in self.branches and intent != self.intent:
+            carry_slots(self.branches[self.intent], self.branches[intent])
+            self.intent = intent
+            return 'switch', intent
+        if intent == 'QA' and self.qa is not None:
+            return 'aside', intent
+        return 'stay', self.intent
+
+    async def handle(self, query, on_token=None, stream: Optional[TokenStream] = None) -> Turn:
+        """Answer one guest message, pushing reply tokens to `on_token` as they arrive."""
+        if stream is None and on_token is not None:
+            stream = TokenStream(on_token)
+        trace = self.instrumentation.start_turn(self.session_id) if self.instrumentation else None
+
+        reply = None
+        intent = self.intent
+        if self.intent not in self.branches:
+            guess = speculation_guess(self.classifier, query, self.speculation, self.branches)
+            speculative = SpeculativeRun(self, guess, query, trace, stream) if guess else None
+            try:
+                prediction = await self.classify(query, callbacks=[trace] if trace else None)
+            except BaseException:
+                if speculative is not None:
+                    await speculative.discard(self.intent_chain.memory)
+                raise
+            self.intent = intent = prediction.intent
+            if trace:
+                trace.intent_source = prediction.source
+            if speculative is not None:
+                hit = prediction.intent == guess
+                if hit:
+                    reply = await speculative.confirm()
+                else:
+                    await speculative.discard(self.intent_chain.memory)
+                self.speculation.record(hit, speculative.tally)
+                if trace:
+                    trace.speculation = "hit" if hit else "miss"
+                    trace.wasted_tokens = 0 if hit else speculative.tally.prompt_tokens + speculative.tally.completion_tokens
+        elif self.switch_detector is not None:
+            if self.switch_detector(query, self.intent):
+                outcome, intent = await self.recheck(query, callbacks=[trace] if trace else None)
+                if trace:
+                    trace.intent_source = "recheck"
+                    trace.recheck = outcome
+            else:
+                # sticky turns go into the intent history too, so a re-check sees the whole conversation
+                self.intent_chain.memory.save_context({"question": query}, {"text": self.intent})
+        callbacks = [handler for handler in (trace, stream) if handler is not None] or None
+        if intent in self.branches:
+            if reply is None:
+                reply = await self.branches[intent](query, callbacks=callbacks)
+            turn = Turn(intent, reply, stream.time_to_first_token if stream is not None else None)
+        elif intent == 'QA' and self.qa is not None:
+            reply = await self.qa(query, callbacks=callbacks)
+            turn = Turn(intent, reply, stream.time_to_first_token if stream is not None else None)
+        else:
+            turn = Turn(intent, self.fallback_reply)
+
+        if trace:
+            self.instrumentation.finish_turn(trace, turn, sum(memory_tokens(m) for m in self.memories))
+        self.last_turn = turn
+        return turn
+
+    async def stream(self, query) -> AsyncIterator[str]:
+        """Answer one guest message as an async iterator of reply tokens.
+
+        Replies that are not generated by a streaming LLM come out as a single
+        chunk. The finished Turn is left in `last_turn`.
+        """
+        stream = TokenStream()
+        task = asyncio.create_task(self.handle(query, stream=stream))
+        task.add_done_callback(lambda _: stream.close())
+        streamed = False
+        async for token in stream:
+            streamed = True
+            yield token
+        turn = await task
+        if not streamed:
+            yield turn.reply
@@ -0,0 +1,120 @@
+import asyncio
+import datetime
+import json
+import re
+import threading
+import time
+from typing import Any, List, Optional
+
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain.chat_models.base import BaseChatModel
+from langchain.pydantic_v1 import Field
+from langchain.schema import AIMessage, ChatGeneration, ChatResult, FunctionMessage
+from langchain.schema.messages import BaseMessage
+
+from memory import approx_token_count
+from slots import extract_date, extract_name, extract_party_size
+
+# Scripted local stand-in for ChatOpenAI, so the flows can be exercised and
+# measured without network access or OpenAI credits.
+
+_INTENT_KEYWORDS = [
+    ('Cancel', re.compile(r"\bcancel|call off\b")),
+    ('Edit', re.compile(r"\b(change|modify|move|reschedule|edit)\b")),
+    ('New', re.compile(r"\b(book|reserve|table|reservation|people|persons)\b")),
+    ('QA', re.compile(r"\?$|\b(open|menu|vegan|parking|where|hours)\b")),
+]
+_FILLER = ("Sure thing, let me check that for you and get back with the details "
+           "you need for your visit to our restaurant tonight").split()
+
+
+class FakeLLMStats:
+    """Call, token and latency counters shared by every chain using a FakeChatModel."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def record(self, prompt_tokens, completion_tokens):
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic chat model answering the bookit prompts from simple rules.
+
+    Intent prompts get one of New/Edit/Cancel/QA/Unclear, OpenAI-functions
+    agent calls get a function call built from the locally extracted slots and
+    then a final answer, everything else gets `completion_tokens` words of
+    filler. Each call sleeps `latency` seconds plus `token_latency` per
+    streamed token.
+    """
+
+    latency: float = 0.05
+    token_latency: float = 0.0
+    completion_tokens: int = 20
+    streaming: bool = False
+    stats: Any = Field(default_factory=FakeLLMStats)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _respond(self, messages: List[BaseMessage], functions=None) -> AIMessage:
+        system = messages[0].content if messages else ""
+        last = messages[-1]
+        if "classify" in system:
+            text = last.content.lower()
+            intent = next((intent for intent, pattern in _INTENT_KEYWORDS if pattern.search(text)), 'Unclear')
+            return AIMessage(content=intent)
+        if functions:
+            if isinstance(last, FunctionMessage):
+                return AIMessage(content=f"There are {last.content} seats available on that date.")
+            return self._function_call(functions[0], last.content)
+        return AIMessage(content=" ".join(_FILLER[i % len(_FILLER)] for i in range(self.completion_tokens)))
+
+    def _function_call(self, function, text):
+        date = extract_date(text) or datetime.date.today() + datetime.timedelta(days=1)
+        arguments = {"date": date.year * 10000 + date.month * 100 + date.day,
+                     "seats": extract_party_size(text) or 2,
+                     "name": extract_name(text) or "Guest"}
+        properties = function.get("parameters", {}).get("properties", {})
+        arguments = {key: value for key, value in arguments.items() if key in properties}
+        return AIMessage(content="", additional_kwargs={
+            "function_call": {"name": function["name"], "arguments": json.dumps(arguments)}})
+
+    def _record(self, messages, message):
+        prompt_tokens = sum(approx_token_count(str(m.content)) for m in messages)
+        completion_tokens = len(message.content.split()) or 1
+        self.stats.record(prompt_tokens, completion_tokens)
+        return completion_tokens
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        message = self._respond(messages, kwargs.get("functions"))
+        completion_tokens = self._record(messages, message)
+        time.sleep(self.latency + self.token_latency * completion_tokens)
+        if self.streaming and run_manager and message.content:
+            for token in message.content.split(" "):
+                run_manager.on_llm_new_token(token + " ")
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        message = self._respond(messages, kwargs.get("functions"))
+        self._record(messages, message)
+        await asyncio.sleep(self.latency)
+        if message.content:
+            for token in message.content.split(" "):
+                if self.token_latency:
+                    await asyncio.sleep(self.token_latency)
+                if self.streaming and run_manager:
+                    await run_manager.on_llm_new_token(token + " ")
+        return ChatResult(generations=[ChatGeneration(message=message)])
@@ -0,0 +1,199 @@
+import math
+import random
+import re
+from collections import Counter
+from typing import NamedTuple, Optional
+
+# Local intent classifier that runs before intent_conversation. Messages it is
+# confident about never leave the process; the rest fall back to the LLM.
+
+INTENTS = ('New', 'Edit', 'Cancel', 'QA')
+
+# keyword rules, checked first; a message matching rules of several intents is
+# left to the model
+RULES = [
+    ('Cancel', re.compile(r"\b(cancel\w*|call(ing)? off|won'?t be (coming|able to make it))\b")),
+    ('Edit', re.compile(r"\b(change|modify|move|reschedule|edit|update|postpone|push back)\b.*\b(booking|reservation|table|it|date|time)\b")),
+    ('Edit', re.compile(r"\b(more|fewer|less|extra) (people|persons|guests|seats)\b.*\b(booking|reservation)\b")),
+    ('New', re.compile(r"\b(book|reserve|table for|reservation for|make a (reservation|booking))\b")),
+    ('QA', re.compile(r"\b(open(ing)?|clos(e|ing)|hours|menu|vegan|vegetarian|gluten|parking|address|located|location|dress code|prices?|wifi|allerg\w*)\b.*\?")),
+]
+
+TRAINING_EXAMPLES = [
+    ('table for 4 on friday', 'New'),
+    ('i would like to book a table', 'New'),
+    ('can i reserve for two people tomorrow', 'New'),
+    ('hi, i want to make a reservation', 'New'),
+    ('do you have room for 6 tonight', 'New'),
+    ('we are 3 people, saturday evening please', 'New'),
+    ('book me a table next week', 'New'),
+    ('reservation for 5 on the 12th', 'New'),
+    ('is there space for a party of eight on sunday', 'New'),
+    ('i need a table for my family this weekend', 'New'),
+    ('any free seats on thursday for 2', 'New'),
+    ('could we get a table for two tonight', 'New'),
+    ('i want to change my reservation', 'Edit'),
+    ('can we move our booking to saturday', 'Edit'),
+    ('please modify my booking to 6 people', 'Edit'),
+    ('reschedule my table to next friday', 'Edit'),
+    ('we will be 2 more people on my reservation', 'Edit'),
+    ('update the date of my booking', 'Edit'),
+    ('i booked for friday but need sunday instead', 'Edit'),
+    ('can i add a person to my reservation', 'Edit'),
+    ('change the number of people on my booking', 'Edit'),
+    ('i have a reservation under john, can we switch the day', 'Edit'),
+    ('cancel my booking', 'Cancel'),
+    ('i want to cancel my reservation', 'Cancel'),
+    ('please cancel the table for friday', 'Cancel'),
+    ('we cannot come anymore', 'Cancel'),
+    ('remove my reservation please', 'Cancel'),
+    ('call off our booking for tomorrow', 'Cancel'),
+    ('i need to cancel, something came up', 'Cancel'),
+    ('delete my booking under sarah', 'Cancel'),
+    ('we will not make it tonight, cancel please', 'Cancel'),
+    ('drop my reservation on the 12th', 'Cancel'),
+    ('what time do you open', 'QA'),
+    ('are you open on mondays', 'QA'),
+    ('do you have vegan options', 'QA'),
+    ('where is the restaurant located', 'QA'),
+    ('is there parking nearby', 'QA'),
+    ('what is on the menu', 'QA'),
+    ('what are your opening hours', 'QA'),
+    ('do you serve gluten free food', 'QA'),
+    ('how much does a dinner cost', 'QA'),
+    ('what is your address', 'QA'),
+    ('do you accept credit cards', 'QA'),
+    ('is there a dress code', 'QA'),
+]
+
+_WORD = re.compile(r"[a-z0-9']+")
+# greetings, politeness and acknowledgements: on their own they say nothing
+# about the intent, so they are not features (see also cache._FILLER_WORDS)
+STOP_WORDS = {'hi', 'hello', 'hey', 'please', 'pls', 'thanks', 'thank', 'you', 'ok', 'okay', 'so', 'um', 'uh',
+              'just', 'there', 'a', 'an', 'the', 'yes', 'yeah', 'yep', 'yup', 'no', 'nope', 'sure', 'great',
+              'cool', 'perfect', 'help'}
+
+
+def _features(text):
+    words = [word for word in _WORD.findall(text.lower()) if word not in STOP_WORDS]
+    return words + [a + ' ' + b for a, b in zip(words, words[1:])]
+
+
+class IntentPrediction(NamedTuple):
+    intent: str
+    confidence: float
+    source: str
+
+
+class FastIntentClassifier:
+    """Keyword rules backed by a small TF-IDF + softmax regression model.
+
+    `classify` returns None when neither tier is at least `threshold`
+    confident, which is the caller's cue to ask the LLM instead. The model
+    only answers for messages with at least `min_terms` known features: the
+    vector is normalized, so a single known word would score as if it were a
+    whole sentence.
+    """
+
+    def __init__(self, examples=TRAINING_EXAMPLES, threshold=0.75, epochs=60, seed=0, min_terms=2):
+        self.threshold = threshold
+        self.min_terms = min_terms
+        self.hits = Counter()
+        self.misses = 0
+        self._fit(examples, epochs, seed)
+
+    def _fit(self, examples, epochs, seed):
+        docs = [Counter(_features(text)) for text, _ in examples]
+        df = Counter(term for doc in docs for term in doc)
+        n = len(docs)
+        self.idf = {term: math.log((1 + n) / (1 + count)) + 1 for term, count in df.items()}
+        self.weights = {intent: {} for intent in INTENTS}
+        self.bias = dict.fromkeys(INTENTS, 0.0)
+
+        samples = [(self._vectorize_counts(doc), label) for doc, (_, label) in zip(docs, examples)]
+        rng = random.Random(seed)
+        rate = 0.5
+        for _ in range(epochs):
+            rng.shuffle(samples)
+            for vector, label in samples:
+                probs = self._probabilities(vector)
+                for intent in INTENTS:
+                    grad = probs[intent] - (intent == label)
+                    weights = self.weights[intent]
+                    for term, value in vector.items():
+                        weights[term] = weights.get(term, 0.0) - rate * grad * value
+                    self.bias[intent] -= rate * grad
+
+    def _vectorize_counts(self, counts):
+        vector = {term: (1 + math.log(tf)) * self.idf[term]
+                  for term, tf in counts.items() if term in self.idf}
+        norm = math.sqrt(sum(v * v for v in vector.values()))
+        return {term: v / norm for term, v in vector.items()} if norm else {}
+
+    def _probabilities(self, vector):
+        scores = {intent: self.bias[intent] + sum(self.weights[intent].get(t, 0.0) * v for t, v in vector.items())
+                  for intent in INTENTS}
+        top = max(scores.values())
+        exps = {intent: math.exp(score - top) for intent, score in scores.items()}
+        total = sum(exps.values())
+        return {intent: value / total for intent, value in exps.items()}
+
+    def predict(self, text) -> Optional[IntentPrediction]:
+        """Best local guess regardless of the threshold, or None if the text has too few known terms."""
+        lowered = text.lower()
+        matched = {intent for intent, pattern in RULES if pattern.search(lowered)}
+        if len(matched) == 1:
+            return IntentPrediction(matched.pop(), 1.0, 'rule')
+        vector = self._vectorize_counts(Counter(_features(text)))
+        if len(vector) < self.min_terms:
+            return None
+        probs = self._probabilities(vector)
+        intent = max(probs, key=probs.get)
+        return IntentPrediction(intent, probs[intent], 'model')
+
+    def classify(self, text) -> Optional[IntentPrediction]:
+        prediction = self.predict(text)
+        if prediction is None or prediction.confidence < self.threshold:
+            self.misses += 1
+            return None
+        self.hits[prediction.source] += 1
+        return prediction
+
+    @property
+    def hit_rate(self):
+        total = sum(self.hits.values()) + self.misses
+        return sum(self.hits.values()) / total if total else 0.0
+
+    def stats(self):
+        return {'rule_hits': self.hits['rule'], 'model_hits': self.hits['model'],
+                'llm_fallbacks': self.misses, 'hit_rate': round(self.hit_rate, 4)}
+
+
+def _has_history(chain):
+    memory = getattr(chain, 'memory', None)
+    if memory is None:
+        return False
+    return bool(memory.chat_memory.messages or getattr(memory, 'slots', None))
+
+
+async def classify_intent(query, intent_conversation, classifier=None, cache=None, callbacks=None) -> IntentPrediction:
+    """Classify locally when confident or cached, otherwise await the intent LLM chain.
+
+    The LLM sees the conversation so far, so `cache` is only used for a
+    session's opening message, and Unclear answers are never stored.
+    """
+    if cache is not None and _has_history(intent_conversation):
+        cache = None
+    prediction = classifier.classify(query) if classifier is not None else None
+    if prediction is None and cache is not None:
+        intent = cache.get(query)
+        if intent is not None:
+            prediction = IntentPrediction(intent, 1.0, 'cache')
+    if prediction is None:
+        intent = (await intent_conversation.arun({"question": query}, callbacks=callbacks)).strip()
+        if cache is not None and intent in INTENTS:
+            cache.put(query, intent)
+        return IntentPrediction(intent, 1.0, 'llm')
+    # keep the intent history consistent with what the LLM would have produced
+    intent_conversation.memory.save_context({"question": query}, {"text": prediction.intent})
+    return prediction
@@ -0,0 +1,224 @@
+import bisect
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks.base import AsyncCallbackHandler
+
+from memory import approx_token_count
+from prompts import SECTIONS, prompt_sections
+
+# Per-turn instrumentation: where a turn spent its time (intent decision, LLM
+# calls, tool calls) exported as Prometheus-style metrics and, optionally, one
+# JSON line per turn. Dispatchers built without an Instrumentation skip all of
+# it, so there is no cost when it is disabled.
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000)
+
+
+def _label_string(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_label_string(key)} {value}" for key, value in sorted(self.values.items())]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        # one slot per bucket plus a final one for values above the last bound
+        counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.values[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_string(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_string(key)} {total}")
+            lines.append(f"{self.name}_count{_label_string(key)} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """The counters and histograms exported by the instrumentation."""
+
+    def __init__(self):
+        self.turns = Counter("bookit_turns_total", "Guest turns by intent and how the intent was decided")
+        self.turn_seconds = Histogram("bookit_turn_seconds", "Wall time of a guest turn")
+        self.llm_calls = Counter("bookit_llm_calls_total", "LLM calls")
+        self.llm_seconds = Histogram("bookit_llm_seconds", "Latency of an LLM call")
+        self.prompt_tokens = Counter("bookit_llm_prompt_tokens_total", "Prompt tokens sent to the LLM")
+        self.completion_tokens = Counter("bookit_llm_completion_tokens_total", "Completion tokens received")
+        self.prompt_section_tokens = Counter("bookit_llm_prompt_section_tokens_total",
+                                             "Prompt tokens by section (system, history, user), estimated")
+        self.tool_calls = Counter("bookit_tool_calls_total", "Tool invocations by tool")
+        self.tool_seconds = Histogram("bookit_tool_seconds", "Latency of a tool invocation")
+        self.memory_tokens = Histogram("bookit_memory_tokens", "Conversation memory size after a turn",
+                                       buckets=TOKEN_BUCKETS)
+        self.sessions_spilled = Counter("bookit_sessions_spilled_total", "Idle sessions moved out of RAM")
+        self.speculations = Counter("bookit_speculations_total", "Branches started before the intent was known")
+        self.speculation_wasted_tokens = Counter("bookit_speculation_wasted_tokens_total",
+                                                 "Tokens spent on discarded speculative branches")
+        self.intent_rechecks = Counter("bookit_intent_rechecks_total",
+                                       "Suspected topic switches re-checked by the intent LLM, by outcome")
+        self.session_resume_seconds = Histogram("bookit_session_resume_seconds",
+                                                "Time to rebuild a spilled session on its next message")
+
+    def render(self):
+        lines = []
+        for metric in vars(self).values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class TurnTrace(AsyncCallbackHandler):
+    """Callback handler collecting the LLM and tool calls of one turn."""
+
+    def __init__(self, session_id=None):
+        self.session_id = session_id
+        self.started_at = time.perf_counter()
+        # 'rule', 'model', 'cache' or 'llm' when the turn was classified, 'recheck' when a
+        # suspected topic switch was re-classified, else it stayed in its branch
+        self.intent_source = "sticky"
+        # 'hit' or 'miss' when a branch was started speculatively, see speculation.py
+        self.speculation: Optional[str] = None
+        self.wasted_tokens = 0
+        # 'switch', 'aside' or 'stay' when a sticky turn was re-checked, see routing.py
+        self.recheck: Optional[str] = None
+        self.llm_calls: List[Dict[str, Any]] = []
+        self.tool_calls: List[Dict[str, Any]] = []
+        self._pending = {}
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs) -> None:
+        sections = dict.fromkeys(SECTIONS, 0)
+        for batch in messages:
+            for section, tokens in prompt_sections(batch).items():
+                sections[section] += tokens
+        self._pending[run_id] = (time.perf_counter(), sum(sections.values()), sections)
+
+    async def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs) -> None:
+        self._pending[run_id] = (time.perf_counter(), sum(approx_token_count(p) for p in prompts), None)
+
+    async def on_llm_end(self, response, *, run_id: UUID, **kwargs) -> None:
+        started, prompt_tokens, sections = self._pending.pop(run_id, (self.started_at, 0, None))
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        text = " ".join(g.text for batch in response.generations for g in batch)
+        self.llm_calls.append({
+            "seconds": time.perf_counter() - started,
+            # streamed completions carry no usage, fall back to estimates
+            "prompt_tokens": usage.get("prompt_tokens", prompt_tokens),
+            "completion_tokens": usage.get("completion_tokens", approx_token_count(text)),
+            "prompt_sections": sections,
+        })
+
+    @property
+    def prompt_sections(self) -> Dict[str, int]:
+        """Estimated prompt tokens of the turn's chat model calls by section."""
+        totals = dict.fromkeys(SECTIONS, 0)
+        for call in self.llm_calls:
+            for section, tokens in (call["prompt_sections"] or {}).items():
+                totals[section] += tokens
+        return totals
+
+    async def on_llm_error(self, error, *, run_id: UUID, **kwargs) -> None:
+        self._pending.pop(run_id, None)
+
+    async def on_tool_start(self, serialized, input_str, *, run_id: UUID, **kwargs) -> None:
+        self._pending[run_id] = (time.perf_counter(), serialized.get("name"))
+
+    async def on_tool_end(self, output, *, run_id: UUID, **kwargs) -> None:
+        started, name = self._pending.pop(run_id, (self.started_at, None))
+        self.tool_calls.append({"tool": name, "seconds": time.perf_counter() - started})
+
+    async def on_tool_error(self, error, *, run_id: UUID, **kwargs) -> None:
+        self._pending.pop(run_id, None)
+
+
+class Instrumentation:
+    """Creates a TurnTrace per turn and folds finished turns into `metrics`.
+
+    With `trace_path`, every turn is also appended to that file as a JSON line.
+    """
+
+    def __init__(self, metrics=None, trace_path=None):
+        self.metrics = metrics or Metrics()
+        self.trace_path = trace_path
+        self._trace_file = open(trace_path, "a") if trace_path else None
+        self._lock = threading.Lock()
+
+    def start_turn(self, session_id=None) -> TurnTrace:
+        return TurnTrace(session_id)
+
+    def finish_turn(self, trace: TurnTrace, turn, memory_tokens=None):
+        seconds = time.perf_counter() - trace.started_at
+        metrics = self.metrics
+        with self._lock:
+            metrics.turns.inc(intent=turn.intent, source=trace.intent_source)
+            metrics.turn_seconds.observe(seconds)
+            for call in trace.llm_calls:
+                metrics.llm_calls.inc()
+                metrics.llm_seconds.observe(call["seconds"])
+                metrics.prompt_tokens.inc(call["prompt_tokens"])
+                metrics.completion_tokens.inc(call["completion_tokens"])
+                for section, tokens in (call["prompt_sections"] or {}).items():
+                    metrics.prompt_section_tokens.inc(tokens, section=section)
+            for call in trace.tool_calls:
+                metrics.tool_calls.inc(tool=call["tool"])
+                metrics.tool_seconds.observe(call["seconds"], tool=call["tool"])
+            if memory_tokens is not None:
+                metrics.memory_tokens.observe(memory_tokens)
+            if trace.speculation is not None:
+                metrics.speculations.inc(outcome=trace.speculation)
+                metrics.speculation_wasted_tokens.inc(trace.wasted_tokens)
+            if trace.recheck is not None:
+                metrics.intent_rechecks.inc(outcome=trace.recheck)
+            if self._trace_file is not None:
+                self._trace_file.write(json.dumps({
+                    "ts": time.time(),
+                    "session": trace.session_id,
+                    "intent": turn.intent,
+                    "intent_source": trace.intent_source,
+                    "seconds": seconds,
+                    "time_to_first_token": turn.time_to_first_token,
+                    "llm_calls": trace.llm_calls,
+                    "tool_calls": trace.tool_calls,
+                    "memory_tokens": memory_tokens,
+                    "prompt_sections": trace.prompt_sections,
+                    "speculation": trace.speculation,
+                    "wasted_tokens": trace.wasted_tokens,
+                    "recheck": trace.recheck,
+                }) + "\n")
+                self._trace_file.flush()
+
+    def close(self):
+        if self._trace_file is not None:
+            self._trace_file.close()
+            self._trace_file = None
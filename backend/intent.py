@@ -1,154 +1,168 @@
-import datetime
-from dotenv import load_dotenv
-import os
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage, FunctionMessage
-from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import (
-    ChatPromptTemplate,
-    HumanMessagePromptTemplate,
-    MessagesPlaceholder,
-    SystemMessagePromptTemplate,
-)
+import asyncio
+from memory import make_memory
+from fast_intent import FastIntentClassifier
+from dispatcher import SessionDispatcher
+from cache import cached_reply, intent_cache, qa_cache
+from registry import ChainRegistry, Lazy
+from routing import ChainBranch, TopicSwitchDetector
+from types import SimpleNamespace
+
+
+registry = ChainRegistry()
+
+
+# Prompts and memoryless chains are shared by every session, see registry.py
+@registry.register("intent_prompt")
+def intent_prompt():
+    from prompts import compile_prompt
+    return compile_prompt(
+        "intent",
+        """
+        You are a chat responsible to handle a restaurant's booking reservations, we serve food and do not host parties.
+        Your current role is to classify the {question} as new booking, booking modification, cancellation or general question regarding the restaurant.
+        You only reply with 'New' if it's a new booking, 'Edit' if it's a modification, 'Cancel' if it's a cancellation, 'QA' if it's a general question regarding the restaurant, 'Unclear' if the intent is none of the 4 listed.
+        """,
+        history_key="intent_history",
+    )
 
 
-def main():
+@registry.register("new_reservation_prompt")
+def new_reservation_prompt(current_date):
+    from prompts import compile_prompt
+    return compile_prompt(
+        "new_reservation",
+        """
+        Today is the {current_date}
+        You are a chatbot that is responsible to handle a restaurant's new booking reservations, you sound as human as possible, answering in short sentences only.
+        Your goal is to gather the number of people and date of reservation, make sure there is a place available.
+
+        If there is a place available, you ask for the name of the person and book the table.
+        If there is no place available, you can propose an alternative date.
+
+        To end the chat, you confirm the details (number of persons, date and name)
+        """,
+        history_key="new_chat_history",
+        current_date=current_date,
+    )
+
+
+@registry.register("edit_reservation_prompt")
+def edit_reservation_prompt(current_date):
+    from prompts import compile_prompt
+    return compile_prompt(
+        "edit_reservation",
+        """
+        Today is the {current_date}
+        You are a chatbot that is responsible to handle editing a restaurant's booking reservations, you sound as human as possible, answering in short sentences only.
+        Your goal is to find the existing reservation by matching the name and number of people, then checking the new date and making sure there is a place available.
+ 
+        If there is no place available, you can propose an alternative date.
+
+        To end the chat, you confirm the details (number of persons, date and name) with the client
+        """,
+        history_key="edit_chat_history",
+        current_date=current_date,
+    )
 
-    # Load environment variables from .env file
-    load_dotenv()
-
-    # Now you can use the environment variable
-    openai_api_key = os.environ.get('OPENAI_API_KEY')
-
-    current_date = datetime.date.today()
-
-    llm = ChatOpenAI(model_name='gpt-3.5-turbo',
-                temperature = 0,
-                max_tokens = 256,
-                openai_api_key=openai_api_key)
-
-
-    
-# Prompt
-    intent_prompt = ChatPromptTemplate(
-        messages=[
-            SystemMessagePromptTemplate.from_template(
-                """
-                You are a chat responsible to handle a restaurant's booking reservations, we serve food and do not host parties.
-                Your current role is to classify the {question} as new booking, booking modification, cancellation or general question regarding the restaurant.
-                You only reply with 'New' if it's a new booking, 'Edit' if it's a modification, 'Cancel' if it's a cancellation, 'QA' if it's a general question regarding the restaurant, 'Unclear' if the intent is none of the 4 listed.
-                """
-            ),
-            # The `variable_name` here is what must align with memory
-            MessagesPlaceholder(variable_name="intent_history"),
-            HumanMessagePromptTemplate.from_template("{question}"),
-        ]
+
+@registry.register("cancel_reservation_prompt")
+def cancel_reservation_prompt(current_date):
+    from prompts import compile_prompt
+    return compile_prompt(
+        "cancel_reservation",
+        """
+        Today is the {current_date}
+        You are a chatbot that is responsible to handle cancelling a restaurant's booking reservations, you sound as human as possible, answering in short sentences only.
+        Your goal is to find the existing reservation by matching the name and date, and cancelling it.
+ 
+        If you don't find the reservation, double check the name and date with the customer.
+
+        To end the chat, you confirm the details the cancellation with the client
+        """,
+        history_key="cancel_chat_history",
+        current_date=current_date,
     )
 
-    intent_memory = ConversationBufferMemory(memory_key="intent_history", return_messages=True)
-    intent_conversation = LLMChain(llm=llm, prompt=intent_prompt, verbose=False, memory=intent_memory)
-
-    # reservation Prompt
-    new_reservation_prompt = ChatPromptTemplate(
-        messages=[
-            SystemMessagePromptTemplate.from_template(
-                """
-                Today is the {current_date}
-                You are a chatbot that is responsible to handle a restaurant's new booking reservations, you sound as human as possible, answering in short sentences only.
-                Your goal is to gather the number of people and date of reservation, make sure there is a place available.
-
-                If there is a place available, you ask for the name of the person and book the table.
-                If there is no place available, you can propose an alternative date.
-
-                To end the chat, you confirm the details (number of persons, date and name)
-                """.format(current_date=current_date)
-            ),
-            # The `variable_name` here is what must align with memory
-            MessagesPlaceholder(variable_name="new_chat_history"),
-            HumanMessagePromptTemplate.from_template("{question}"),
-        ],
+
+@registry.register("qa_chain")
+def qa_chain(llm):
+    from langchain.chains import LLMChain
+    from prompts import compile_prompt
+    qa_prompt = compile_prompt(
+        "qa",
+        """
+        You are a chatbot answering general questions about a restaurant, we serve food and do not host parties. You sound as human as possible, answering in short sentences only.
+        If you do not know the answer, say so and offer to help with a reservation instead.
+        """,
     )
+    # no memory: answers do not depend on the conversation, so they are cached and shared across guests
+    return LLMChain(llm=llm, prompt=qa_prompt, verbose=False)
+
 
+def build_chains(llm, current_date=None):
+    """Build the chains of one conversation; each call gets fresh memories.
+
+    The chains are built when first used, from prompts shared through `registry`.
+    The prompts follow today's date unless `current_date` pins one.
+    """
     # Notice that we `return_messages=True` to fit into the MessagesPlaceholder
     # Notice that `"chat_history"` aligns with the MessagesPlaceholder name
     # Notice that we just pass in the `question` variables - `chat_history` gets populated by memory
-    memory = ConversationBufferMemory(memory_key="new_chat_history", return_messages=True)
-    new_reservation_conversation = LLMChain(llm=llm, prompt=new_reservation_prompt, verbose=False, memory = memory) 
-
-
-# edit Prompt
-    edit_reservation_prompt = ChatPromptTemplate(
-        messages=[
-            SystemMessagePromptTemplate.from_template(
-                """
-                Today is the {current_date}
-                You are a chatbot that is responsible to handle editing a restaurant's booking reservations, you sound as human as possible, answering in short sentences only.
-                Your goal is to find the existing reservation by matching the name and number of people, then checking the new date and making sure there is a place available.
- 
-                If there is no place available, you can propose an alternative date.
-
-                To end the chat, you confirm the details (number of persons, date and name) with the client
-                """.format(current_date=current_date)
-            ),
-            # The `variable_name` here is what must align with memory
-            MessagesPlaceholder(variable_name="edit_chat_history"),
-            HumanMessagePromptTemplate.from_template("{question}"),
-        ]
+    memories = SimpleNamespace(
+        intent=make_memory("intent_history"),
+        new=make_memory("new_chat_history"),
+        edit=make_memory("edit_chat_history"),
+        cancel=make_memory("cancel_chat_history"),
     )
-    memory = ConversationBufferMemory(memory_key="edit_chat_history", return_messages=True)
-    edit_reservation_conversation = LLMChain(llm=llm, prompt=edit_reservation_prompt, verbose=False, memory = memory)
-
-
-# cancel Prompt
-    cancel_reservation_prompt = ChatPromptTemplate(
-        messages=[
-            SystemMessagePromptTemplate.from_template(
-                """
-                Today is the {current_date}
-                You are a chatbot that is responsible to handle cancelling a restaurant's booking reservations, you sound as human as possible, answering in short sentences only.
-                Your goal is to find the existing reservation by matching the name and date, and cancelling it.
- 
-                If you don't find the reservation, double check the name and date with the customer.
-
-                To end the chat, you confirm the details the cancellation with the client
-                """.format(current_date=current_date)
-            ),
-            # The `variable_name` here is what must align with memory
-            MessagesPlaceholder(variable_name="cancel_chat_history"),
-            HumanMessagePromptTemplate.from_template("{question}"),
-        ]
+
+    def conversation(prompt_name, memory, *args):
+        def build():
+            from langchain.chains import LLMChain
+            return LLMChain(llm=llm, prompt=registry.get(prompt_name, *args), verbose=False, memory=memory)
+        return Lazy(build)
+
+    return SimpleNamespace(
+        intent=conversation("intent_prompt", memories.intent),
+        new=conversation("new_reservation_prompt", memories.new, current_date),
+        edit=conversation("edit_reservation_prompt", memories.edit, current_date),
+        cancel=conversation("cancel_reservation_prompt", memories.cancel, current_date),
+        qa=Lazy(lambda: registry.get("qa_chain", llm)),
+        memories=memories,
     )
-    memory = ConversationBufferMemory(memory_key="cancel_chat_history", return_messages=True)
-    cancel_reservation_conversation = LLMChain(llm=llm, prompt=cancel_reservation_prompt, verbose=False, memory = memory)
 
 
+def build_dispatcher(llm, classifier=None, instrumentation=None, speculation=None):
+    """Build the intent router of one guest session."""
+    chains = build_chains(llm)
+    branches = {
+        'New': ChainBranch(chains.new, chains.memories.new),
+        'Edit': ChainBranch(chains.edit, chains.memories.edit),
+        'Cancel': ChainBranch(chains.cancel, chains.memories.cancel),
+    }
+    memories = [chains.memories.intent, chains.memories.new, chains.memories.edit, chains.memories.cancel]
+    qa = cached_reply(qa_cache, lambda query, callbacks=None: chains.qa.arun({"question": query}, callbacks=callbacks))
+    classifier = classifier or FastIntentClassifier()
+    return SessionDispatcher(chains.intent, branches, classifier=classifier,
+                             instrumentation=instrumentation, memories=memories,
+                             qa=qa, intent_cache=intent_cache, speculation=speculation,
+                             switch_detector=TopicSwitchDetector(classifier))
+
+
+async def chat(dispatcher):
     # conversation flow
-    query = input("Human: ")
-    intent = intent_conversation.run({"question": query})
-    print(intent)
     while True:
-        match intent:
-            case 'New':
-                print('entering new')
-                print(new_reservation_conversation.run({"question": query}))
-                query = input("Human: ")
-            case 'Edit':
-                print('entering edit')
-                print(edit_reservation_conversation.run({"question": query}))
-                query = input("Human: ")
-            case 'Cancel':
-                print('cancel')
-                print(cancel_reservation_conversation.run({"question": query}))
-                query = input("Human: ")
-            case _:
-                print('entering default')
-                query = input("Human: ")
-                intent = intent_conversation.run({"question": query})
-                print(intent)
+        query = await asyncio.to_thread(input, "Human: ")
+        async for token in dispatcher.stream(query):
+            print(token, end="", flush=True)
+        print()
+        turn = dispatcher.last_turn
+        print(turn.intent, turn.time_to_first_token, dispatcher.classifier.stats())
 
 
+def main():
+    from llm_client import build_llm
+    asyncio.run(chat(build_dispatcher(build_llm(streaming=True))))
 
 
 if __name__ == "__main__": 
-    main()
\ No newline at end of file
+    main()
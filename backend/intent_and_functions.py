@@ -1,39 +1,65 @@
-import datetime
-from dotenv import load_dotenv
-import os
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage, FunctionMessage
-from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import (
-    ChatPromptTemplate,
-    HumanMessagePromptTemplate,
-    MessagesPlaceholder,
-    SystemMessagePromptTemplate,
-)
+import asyncio
+import logging
+from memory import make_memory
+from fast_intent import FastIntentClassifier
+from dispatcher import SessionDispatcher
+from cache import cached_reply, intent_cache, qa_cache
+from registry import ChainRegistry, Lazy
+from routing import TopicSwitchDetector
 from langchain.tools import BaseTool
+from langchain.tools.base import ToolException
 from pydantic import BaseModel, Field
-from langchain.agents import initialize_agent, Tool
-from langchain.agents import AgentType
+from types import SimpleNamespace
 from typing import Optional, Type, ClassVar
+from reservations import open_store, to_date
+from booking import BookingFlow, ChangeFlow
 
-available_tables = 15
+reservations = open_store(capacity=15)
+# stdout carries the chat, the server protocol and benchmark results
+logger = logging.getLogger(__name__)
 
 
+def tool_date(value):
+    # a ToolException is shown to the agent as the tool's answer instead of ending the run
+    try:
+        return to_date(value)
+    except (TypeError, ValueError) as e:
+        raise ToolException(f"invalid date {value!r}: ask the customer for the date") from e
+
 def get_available_spots_on_date(date):
-    print('entered get available spots')
-    return available_tables
+    logger.debug('entered get available spots')
+    return reservations.available(tool_date(date))
+
+def get_nearest_available_dates(date, seats, k=3):
+    return [d.isoformat() for d in reservations.nearest_available(tool_date(date), seats, k)]
 
 def new_reservation(date, seats, name):
-    print('new reservation booked')
-    available_tables -= seats
+    # check and book happen atomically under the date's lock
+    if reservations.book(tool_date(date), seats, name) is None:
+        return 0
+    logger.debug('new reservation booked')
+    return 1
+
+def find_reservation(name, date):
+    reservation = reservations.find(name, tool_date(date))
+    return reservation.seats if reservation is not None else 0
+
+def edit_reservation(name, date, new_date=None, seats=None):
+    new_date = tool_date(new_date) if new_date is not None else None
+    if reservations.edit(name, tool_date(date), new_date=new_date, seats=seats) is None:
+        return 0
+    return 1
+
+def cancel_reservation(name, date):
+    if reservations.cancel(name, tool_date(date)) is None:
+        return 0
     return 1
 
 # class to get available tables by date
 class AvailableTablesByDateInput(BaseModel):
     """Input for available seats on specific date check."""
 
-    date: int = Field(..., description="Date on which the customer wants to make a reservation")
+    date: int = Field(..., description="Date on which the customer wants to make a reservation, as a day of the month or YYYYMMDD")
 
 class AvailableTablesByDate(BaseTool):
     name = "get_available_spots_on_date"
@@ -42,14 +68,42 @@ class AvailableTablesByDate(BaseTool):
     def _run(self, date: int):
             tables = get_available_spots_on_date(date)
             return tables
+
+    async def _arun(self, date: int):
+            # sub-millisecond lookup, no need for the default thread pool hop
+            return self._run(date)
     
     args_schema: Optional[Type[BaseModel]] = AvailableTablesByDateInput
+    handle_tool_error = True
+    handle_validation_error = True
+
+# class to find alternative dates when the requested one is full
+class NearestAvailableDatesInput(BaseModel):
+    """Input for finding the closest dates with enough free seats."""
+
+    date: int = Field(..., description="Date the customer asked for, as a day of the month or YYYYMMDD")
+    seats: int = Field(..., description="Number of seats the customer needs")
+    k: int = Field(3, description="Number of alternative dates to return")
+
+class NearestAvailableDates(BaseTool):
+    name = "get_nearest_available_dates"
+    description = "Get the dates closest to the requested one that still have enough free seats, to propose as alternatives"
+
+    def _run(self, date: int, seats: int, k: int = 3):
+            return get_nearest_available_dates(date, seats, k)
+
+    async def _arun(self, date: int, seats: int, k: int = 3):
+            return self._run(date, seats, k)
+
+    args_schema: Optional[Type[BaseModel]] = NearestAvailableDatesInput
+    handle_tool_error = True
+    handle_validation_error = True
 
 # class to make new reservation
 class NewReservationInput(BaseModel):
     """Input for making a new reservation on a specific date."""
 
-    date: int = Field(..., description="Date on which the customer wants to make a reservation")
+    date: int = Field(..., description="Date on which the customer wants to make a reservation, as a day of the month or YYYYMMDD")
     seats: int = Field(..., description="Number of seats to be reserved on the specified date")
     name: str = Field(..., description="Name of the customer making a reservation")
 
@@ -61,212 +115,338 @@ class NewReservation(BaseTool):
     def _run(self, date: int, seats: int, name: str):
             tables = new_reservation(date, seats, name)
             return tables
+
+    async def _arun(self, date: int, seats: int, name: str):
+            # a booking may wait for a database commit, keep it off the event loop
+            return await asyncio.to_thread(self._run, date, seats, name)
     
     args_schema: Optional[Type[BaseModel]] = NewReservationInput
+    handle_tool_error = True
+    handle_validation_error = True
+
+# class to find an existing reservation
+class FindReservationInput(BaseModel):
+    """Input for looking up a reservation by name and date."""
+
+    name: str = Field(..., description="Name the reservation is under")
+    date: int = Field(..., description="Date of the reservation, as a day of the month or YYYYMMDD")
+
+
+class FindReservation(BaseTool):
+    name = "find_reservation"
+    description = "Get the number of seats of the reservation under that name on that date, 0 if there is none"
+
+    def _run(self, name: str, date: int):
+            return find_reservation(name, date)
+
+    async def _arun(self, name: str, date: int):
+            return self._run(name, date)
+
+    args_schema: Optional[Type[BaseModel]] = FindReservationInput
+    handle_tool_error = True
+    handle_validation_error = True
+
+# class to move or resize a reservation
+class EditReservationInput(BaseModel):
+    """Input for changing the date and/or party size of a reservation."""
+
+    name: str = Field(..., description="Name the reservation is under")
+    date: int = Field(..., description="Current date of the reservation, as a day of the month or YYYYMMDD")
+    new_date: Optional[int] = Field(None, description="New date, as a day of the month or YYYYMMDD")
+    seats: Optional[int] = Field(None, description="New number of seats")
+
+
+class EditReservation(BaseTool):
+    name = "edit_reservation"
+    description = "Move a reservation to a new date and/or change its number of seats, returns 0 if not possible"
+
+    def _run(self, name: str, date: int, new_date: Optional[int] = None, seats: Optional[int] = None):
+            return edit_reservation(name, date, new_date, seats)
+
+    async def _arun(self, name: str, date: int, new_date: Optional[int] = None, seats: Optional[int] = None):
+            return await asyncio.to_thread(self._run, name, date, new_date, seats)
+
+    args_schema: Optional[Type[BaseModel]] = EditReservationInput
+    handle_tool_error = True
+    handle_validation_error = True
+
+# class to cancel a reservation
+class CancelReservationInput(BaseModel):
+    """Input for cancelling a reservation."""
+
+    name: str = Field(..., description="Name the reservation is under")
+    date: int = Field(..., description="Date of the reservation, as a day of the month or YYYYMMDD")
+
+
+class CancelReservation(BaseTool):
+    name = "cancel_reservation"
+    description = "Cancel the reservation under that name on that date, returns 0 if there is none"
+
+    def _run(self, name: str, date: int):
+            return cancel_reservation(name, date)
+
+    async def _arun(self, name: str, date: int):
+            return await asyncio.to_thread(self._run, name, date)
+
+    args_schema: Optional[Type[BaseModel]] = CancelReservationInput
+    handle_tool_error = True
+    handle_validation_error = True
     
-def main():
 
-    # Load environment variables from .env file
-    load_dotenv()
+registry = ChainRegistry()
 
-    # Now you can use the environment variable
-    openai_api_key = os.environ.get('OPENAI_API_KEY')
 
-    current_date = datetime.date.today()
+# Tools, agents, prompts and memoryless chains are shared by every session, see registry.py
+@registry.register("tools")
+def tools():
+    return SimpleNamespace(availability=AvailableTablesByDate(), alternatives=NearestAvailableDates(),
+                           reservation=NewReservation(), find=FindReservation(), edit=EditReservation(),
+                           cancel=CancelReservation())
 
-    available_seats_tool = [AvailableTablesByDate()] 
-    new_reservation_tool = [NewReservation()]
 
-    llm = ChatOpenAI(model_name='gpt-3.5-turbo',
-                temperature = 0,
-                max_tokens = 256,
-                openai_api_key=openai_api_key)
+@registry.register("seats_agent")
+def seats_agent(llm):
+    # langchain.agents is slow to import, only load it when an agent is needed
+    from langchain.agents import AgentType, initialize_agent
+    available_seats_tool = [registry.get("tools").availability, registry.get("tools").alternatives]
+    # not verbose: tool and LLM calls are traced by instrumentation (server.py --trace)
+    return initialize_agent(available_seats_tool, llm, agent=AgentType.OPENAI_FUNCTIONS, verbose=False)
 
-    seats_agent = initialize_agent(available_seats_tool, llm, agent=AgentType.OPENAI_FUNCTIONS, verbose=True)
-    reservation_agent = initialize_agent(new_reservation_tool, llm, agent=AgentType.OPENAI_FUNCTIONS, verbose=True)
-    """
-    function_descriptions = [
-        {
-            "name": "get_available_spots_on_date",
-            "description": "Get the number of available reservable seats on that date",
-            "parameters": {
-                "type": "integer",
-                "properties": {
-                    "date": {
-                        "type": "integer",
-                        "description": "the date on which one is checking availabilities",
-                    },
+
+@registry.register("reservation_agent")
+def reservation_agent(llm):
+    from langchain.agents import AgentType, initialize_agent
+    new_reservation_tool = [registry.get("tools").reservation]
+    return initialize_agent(new_reservation_tool, llm, agent=AgentType.OPENAI_FUNCTIONS, verbose=False)
+
+
+"""
+function_descriptions = [
+    {
+        "name": "get_available_spots_on_date",
+        "description": "Get the number of available reservable seats on that date",
+        "parameters": {
+            "type": "integer",
+            "properties": {
+                "date": {
+                    "type": "integer",
+                    "description": "the date on which one is checking availabilities",
                 },
-                "required": ["date"],
             },
+            "required": ["date"],
         },
-        {
-            "name": "new_reservation",
-            "description": "Make a new reservation",
-            "parameters": {
-                "type": "integer",
-                "properties": {
-                    "date": {
-                        "type": "integer",
-                        "description": "the date on which one is checking availabilities",
-                    },
-                    "seats": {
-                        "type": "integer",
-                        "description": "the number of seats to reserve",
-                    },
-                    "name": {
-                        "type": "string",
-                        "description": "the name on which the reservation is",
-                    },
+    },
+    {
+        "name": "new_reservation",
+        "description": "Make a new reservation",
+        "parameters": {
+            "type": "integer",
+            "properties": {
+                "date": {
+                    "type": "integer",
+                    "description": "the date on which one is checking availabilities",
+                },
+                "seats": {
+                    "type": "integer",
+                    "description": "the number of seats to reserve",
+                },
+                "name": {
+                    "type": "string",
+                    "description": "the name on which the reservation is",
                 },
-                "required": ["date", "seats", "name"],
             },
+            "required": ["date", "seats", "name"],
         },
-        {
-            "name": "edit_reservation",
-            "description": "Modify an existing reservation",
-            "parameters": {
-                "type": "integer",
-                "properties": {
-                    "old_date": {
-                        "type": "integer",
-                        "description": "the date on which the current reservation is",
-                    },
-                    "seats": {
-                        "type": "integer",
-                        "description": "the number of seats to reserve",
-                    },
-                    "name": {
-                        "type": "string",
-                        "description": "the name on which the reservation is",
-                    },
-                    "new_date":{
-                        "type": "integer",
-                        "description": "the date on which the reservation will be"
-                    }
+    },
+    {
+        "name": "edit_reservation",
+        "description": "Modify an existing reservation",
+        "parameters": {
+            "type": "integer",
+            "properties": {
+                "old_date": {
+                    "type": "integer",
+                    "description": "the date on which the current reservation is",
+                },
+                "seats": {
+                    "type": "integer",
+                    "description": "the number of seats to reserve",
                 },
-                "required": ["old_date", "seats", "name", "new_date"],
+                "name": {
+                    "type": "string",
+                    "description": "the name on which the reservation is",
+                },
+                "new_date":{
+                    "type": "integer",
+                    "description": "the date on which the reservation will be"
+                }
             },
-        }
-    ]
+            "required": ["old_date", "seats", "name", "new_date"],
+        },
+    }
+]
 """
 
-# Prompt
-    intent_prompt = ChatPromptTemplate(
-        messages=[
-            SystemMessagePromptTemplate.from_template(
-                """
-                You are a chat responsible to handle a restaurant's booking reservations, we serve food and do not host parties.
-                Your current role is to classify the {question} as new booking, booking modification, cancellation or general question regarding the restaurant.
-                You only reply with 'New' if it's a new booking, 'Edit' if it's a modification, 'Cancel' if it's a cancellation, 'QA' if it's a general question regarding the restaurant, 'Unclear' if the intent is none of the 4 listed.
-                """
-            ),
-            # The `variable_name` here is what must align with memory
-            MessagesPlaceholder(variable_name="intent_history"),
-            HumanMessagePromptTemplate.from_template("{question}"),
-        ]
+
+@registry.register("intent_prompt")
+def intent_prompt():
+    from prompts import compile_prompt
+    return compile_prompt(
+        "intent",
+        """
+        You are a chat responsible to handle a restaurant's booking reservations, we serve food and do not host parties.
+        Your current role is to classify the {question} as new booking, booking modification, cancellation or general question regarding the restaurant.
+        You only reply with 'New' if it's a new booking, 'Edit' if it's a modification, 'Cancel' if it's a cancellation, 'QA' if it's a general question regarding the restaurant, 'Unclear' if the intent is none of the 4 listed.
+        """,
+        history_key="intent_history",
+    )
+
+
+@registry.register("new_reservation_prompt")
+def new_reservation_prompt(current_date):
+    from prompts import compile_prompt
+    return compile_prompt(
+        "new_reservation",
+        """
+        Today is the {current_date}
+        You are a chatbot that is responsible to handle a restaurant's new booking reservations, you sound as human as possible, answering in short sentences only.
+        Your goal is to gather the number of people and date of reservation, make sure there is a place available.
+
+        If there is a place available, you ask for the name of the person and book the table.
+        If there is no place available, you can propose an alternative date.
+
+        To end the chat, you confirm the details (number of persons, date and name)
+        """,
+        history_key="new_chat_history",
+        human_template="{question}, {available_seats}",
+        current_date=current_date,
+    )
+
+
+@registry.register("edit_reservation_prompt")
+def edit_reservation_prompt(current_date):
+    from prompts import compile_prompt
+    return compile_prompt(
+        "edit_reservation",
+        """
+        Today is the {current_date}
+        You are a chatbot that is responsible to handle editing a restaurant's booking reservations, you sound as human as possible, answering in short sentences only.
+        Your goal is to find the existing reservation by matching the name and number of people, then checking the new date and making sure there is a place available.
+ 
+        If there is no place available, you can propose an alternative date.
+
+        To end the chat, you confirm the details (number of persons, date and name) with the client
+        """,
+        history_key="edit_chat_history",
+        human_template="{question}, {details}",
+        current_date=current_date,
     )
 
-    intent_memory = ConversationBufferMemory(memory_key="intent_history", return_messages=True)
-    intent_conversation = LLMChain(llm=llm, prompt=intent_prompt, verbose=False, memory=intent_memory)
-
-    # reservation Prompt
-    new_reservation_prompt = ChatPromptTemplate(
-        messages=[
-            SystemMessagePromptTemplate.from_template(
-                """
-                Today is the {current_date}
-                You are a chatbot that is responsible to handle a restaurant's new booking reservations, you sound as human as possible, answering in short sentences only.
-                Your goal is to gather the number of people and date of reservation, make sure there is a place available.
-
-                If there is a place available, you ask for the name of the person and book the table.
-                If there is no place available, you can propose an alternative date.
-
-                To end the chat, you confirm the details (number of persons, date and name)
-                """.format(current_date=current_date)
-            ),
-            # The `variable_name` here is what must align with memory
-            MessagesPlaceholder(variable_name="new_chat_history"),
-            HumanMessagePromptTemplate.from_template("{question}, {available_seats}"),
-        ],
+
+@registry.register("cancel_reservation_prompt")
+def cancel_reservation_prompt(current_date):
+    from prompts import compile_prompt
+    return compile_prompt(
+        "cancel_reservation",
+        """
+        Today is the {current_date}
+        You are a chatbot that is responsible to handle cancelling a restaurant's booking reservations, you sound as human as possible, answering in short sentences only.
+        Your goal is to find the existing reservation by matching the name and date, and cancelling it.
+ 
+        If you don't find the reservation, double check the name and date with the customer.
+
+        To end the chat, you confirm the details the cancellation with the client
+        """,
+        history_key="cancel_chat_history",
+        human_template="{question}, {details}",
+        current_date=current_date,
     )
 
+
+@registry.register("qa_chain")
+def qa_chain(llm):
+    from langchain.chains import LLMChain
+    from prompts import compile_prompt
+    qa_prompt = compile_prompt(
+        "qa",
+        """
+        You are a chatbot answering general questions about a restaurant, we serve food and do not host parties. You sound as human as possible, answering in short sentences only.
+        If you do not know the answer, say so and offer to help with a reservation instead.
+        """,
+    )
+    # no memory: answers do not depend on the conversation, so they are cached and shared across guests
+    return LLMChain(llm=llm, prompt=qa_prompt, verbose=False)
+
+
+def build_chains(llm, current_date=None):
+    """Build the chains and agents of one conversation; each call gets fresh memories.
+
+    The chains are built when first used, from prompts and agents shared through `registry`.
+    The prompts follow today's date unless `current_date` pins one.
+    """
     # Notice that we `return_messages=True` to fit into the MessagesPlaceholder
     # Notice that `"chat_history"` aligns with the MessagesPlaceholder name
     # Notice that we just pass in the `question` variables - `chat_history` gets populated by memory
-    memory = ConversationBufferMemory(memory_key="new_chat_history", return_messages=True)
-    new_reservation_conversation = LLMChain(llm=llm, prompt=new_reservation_prompt, verbose=False, memory = memory) 
-
-
-# edit Prompt
-    edit_reservation_prompt = ChatPromptTemplate(
-        messages=[
-            SystemMessagePromptTemplate.from_template(
-                """
-                Today is the {current_date}
-                You are a chatbot that is responsible to handle editing a restaurant's booking reservations, you sound as human as possible, answering in short sentences only.
-                Your goal is to find the existing reservation by matching the name and number of people, then checking the new date and making sure there is a place available.
- 
-                If there is no place available, you can propose an alternative date.
-
-                To end the chat, you confirm the details (number of persons, date and name) with the client
-                """.format(current_date=current_date)
-            ),
-            # The `variable_name` here is what must align with memory
-            MessagesPlaceholder(variable_name="edit_chat_history"),
-            HumanMessagePromptTemplate.from_template("{question}"),
-        ]
+    memories = SimpleNamespace(
+        intent=make_memory("intent_history"),
+        new=make_memory("new_chat_history", input_key="question"),
+        edit=make_memory("edit_chat_history", input_key="question"),
+        cancel=make_memory("cancel_chat_history", input_key="question"),
     )
-    memory = ConversationBufferMemory(memory_key="edit_chat_history", return_messages=True)
-    edit_reservation_conversation = LLMChain(llm=llm, prompt=edit_reservation_prompt, verbose=False, memory = memory)
-
-
-# cancel Prompt
-    cancel_reservation_prompt = ChatPromptTemplate(
-        messages=[
-            SystemMessagePromptTemplate.from_template(
-                """
-                Today is the {current_date}
-                You are a chatbot that is responsible to handle cancelling a restaurant's booking reservations, you sound as human as possible, answering in short sentences only.
-                Your goal is to find the existing reservation by matching the name and date, and cancelling it.
- 
-                If you don't find the reservation, double check the name and date with the customer.
-
-                To end the chat, you confirm the details the cancellation with the client
-                """.format(current_date=current_date)
-            ),
-            # The `variable_name` here is what must align with memory
-            MessagesPlaceholder(variable_name="cancel_chat_history"),
-            HumanMessagePromptTemplate.from_template("{question}"),
-        ]
+
+    def conversation(prompt_name, memory, *args):
+        def build():
+            from langchain.chains import LLMChain
+            return LLMChain(llm=llm, prompt=registry.get(prompt_name, *args), verbose=False, memory=memory)
+        return Lazy(build)
+
+    return SimpleNamespace(
+        intent=conversation("intent_prompt", memories.intent),
+        seats_agent=Lazy(lambda: registry.get("seats_agent", llm)),
+        reservation_agent=Lazy(lambda: registry.get("reservation_agent", llm)),
+        new=conversation("new_reservation_prompt", memories.new, current_date),
+        edit=conversation("edit_reservation_prompt", memories.edit, current_date),
+        cancel=conversation("cancel_reservation_prompt", memories.cancel, current_date),
+        qa=Lazy(lambda: registry.get("qa_chain", llm)),
+        memories=memories,
     )
-    memory = ConversationBufferMemory(memory_key="cancel_chat_history", return_messages=True)
-    cancel_reservation_conversation = LLMChain(llm=llm, prompt=cancel_reservation_prompt, verbose=False, memory = memory)
 
+
+def build_dispatcher(llm, classifier=None, current_date=None, instrumentation=None, speculation=None):
+    """Build the intent router of one guest session."""
+    chains = build_chains(llm, current_date)
+    tools = registry.get("tools")
+    branches = {
+        # slots are extracted locally and the tools called directly, the agent
+        # only handles messages the extractor finds ambiguous
+        'New': BookingFlow(chains.new, chains.seats_agent, tools.availability, tools.reservation,
+                           current_date, alternatives_tool=tools.alternatives),
+        'Edit': ChangeFlow('edit', chains.edit, tools.find, tools.edit, current_date),
+        'Cancel': ChangeFlow('cancel', chains.cancel, tools.find, tools.cancel, current_date),
+    }
+    memories = [chains.memories.intent, chains.memories.new, chains.memories.edit, chains.memories.cancel]
+    qa = cached_reply(qa_cache, lambda query, callbacks=None: chains.qa.arun({"question": query}, callbacks=callbacks))
+    classifier = classifier or FastIntentClassifier()
+    return SessionDispatcher(chains.intent, branches, classifier=classifier,
+                             instrumentation=instrumentation, memories=memories,
+                             qa=qa, intent_cache=intent_cache, speculation=speculation,
+                             switch_detector=TopicSwitchDetector(classifier))
+
+
+async def chat(dispatcher):
     # conversation flow
-    query = input("Human: ")
-    intent = intent_conversation.run({"question": query})
-    print(intent)
     while True:
-        match intent:
-            case 'New':
-                print('entering new')
-                print(seats_agent.run(query))
-                #print(new_reservation_conversation.run({"question": query, "available_seats": available_seats}))
-                query = input("Human: ")
-            case 'Edit':
-                print('entering edit')
-                print(edit_reservation_conversation.run({"question": query}))
-                query = input("Human: ")
-            case 'Cancel':
-                print('cancel')
-                print(cancel_reservation_conversation.run({"question": query}))
-                query = input("Human: ")
-            case _:
-                print('entering default')
-                query = input("Human: ")
-                intent = intent_conversation.run({"question": query})
-                print(intent)
+        query = await asyncio.to_thread(input, "Human: ")
+        async for token in dispatcher.stream(query):
+            print(token, end="", flush=True)
+        print()
+        turn = dispatcher.last_turn
+        print(turn.intent, turn.time_to_first_token, dispatcher.classifier.stats())
+
+
+def main():
+    from llm_client import build_llm
+    asyncio.run(chat(build_dispatcher(build_llm(streaming=True))))
 
 if __name__ == "__main__": 
-    main()
\ No newline at end of file
+    main()
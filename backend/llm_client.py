@@ -0,0 +1,337 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from typing import Any, List, Optional
+
+from dotenv import load_dotenv
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain.chat_models import ChatOpenAI
+from langchain.pydantic_v1 import Field
+from langchain.schema import ChatResult, HumanMessage
+from langchain.schema.messages import BaseMessage, messages_to_dict
+
+# Process-wide LLM client: every chain and agent of every session shares one
+# ChatOpenAI per streaming mode, one pool of keep-alive HTTP connections, one
+# in-flight cap and one rate limiter, so a burst of 429s slows everyone down
+# a little instead of stalling whoever hit it.
+
+# statuses worth retrying: timeouts, conflicts, rate limits and server errors
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+# errors without a status code (openai 1.x and 0.x names)
+_RETRY_ERRORS = {"APIConnectionError", "APITimeoutError", "Timeout", "RateLimitError",
+                 "ServiceUnavailableError", "TryAgain"}
+
+
+def is_retryable(error):
+    status = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+    if status is not None:
+        return status in RETRY_STATUS
+    return type(error).__name__ in _RETRY_ERRORS
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait (Retry-After header), or None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, in bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return how long to wait before using it.
+
+        Tokens may be taken ahead of time (the count goes negative), so
+        waiters are served in order without polling.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class ClientLimits:
+    """In-flight cap, rate limit and jittered exponential backoff around LLM calls.
+
+    Async calls are capped by a semaphore per event loop (the server runs a
+    single loop per process), sync calls by a thread semaphore of the same
+    size. Retries wait for `Retry-After` if the server sent one, otherwise a
+    random delay in [0, min(max_delay, base_delay * 2**attempt)].
+    """
+
+    def __init__(self, max_in_flight=16, rate=None, burst=None, max_retries=4, base_delay=0.5, max_delay=20.0):
+        self.max_in_flight = max_in_flight
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # concurrent identical requests, see PooledChatOpenAI
+        self.pending = {}
+        self._thread_slots = threading.BoundedSemaphore(max_in_flight)
+        self._loop_slots = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.reset()
+
+    @classmethod
+    def from_env(cls):
+        rate = os.environ.get("BOOKIT_LLM_RPS")
+        return cls(max_in_flight=int(os.environ.get("BOOKIT_LLM_MAX_IN_FLIGHT", 16)),
+                   rate=float(rate) if rate else None,
+                   max_retries=int(os.environ.get("BOOKIT_LLM_RETRIES", 4)))
+
+    def reset(self):
+        self.calls = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.throttled_seconds = 0.0
+        self.in_flight = 0
+        self.max_seen_in_flight = 0
+
+    def stats(self):
+        return {"calls": self.calls, "retries": self.retries, "coalesced": self.coalesced,
+                "throttled_seconds": round(self.throttled_seconds, 3),
+                "max_in_flight": self.max_seen_in_flight}
+
+    def _slots(self):
+        loop = asyncio.get_running_loop()
+        slots = self._loop_slots.get(loop)
+        if slots is None:
+            slots = self._loop_slots[loop] = asyncio.Semaphore(self.max_in_flight)
+        return slots
+
+    def _throttle(self):
+        wait = self.bucket.reserve() if self.bucket else 0.0
+        with self._lock:
+            self.calls += 1
+            self.throttled_seconds += wait
+            self.in_flight += 1
+            self.max_seen_in_flight = max(self.max_seen_in_flight, self.in_flight)
+        return wait
+
+    def _done(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _backoff(self, attempt, error):
+        with self._lock:
+            self.retries += 1
+        delay = retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return delay
+
+    async def acall(self, call):
+        """Await `call()` within the limits, retrying transient errors."""
+        attempt = 0
+        while True:
+            async with self._slots():
+                wait = self._throttle()
+                try:
+                    if wait:
+                        await asyncio.sleep(wait)
+                    return await call()
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_retryable(e):
+                        raise
+                    delay = self._backoff(attempt, e)
+                finally:
+                    self._done()
+            # the slot is released while backing off
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def call(self, call):
+        """Blocking counterpart of `acall`."""
+        attempt = 0
+        while True:
+            with self._thread_slots:
+                wait = self._throttle()
+                try:
+                    if wait:
+                        time.sleep(wait)
+                    return call()
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_retryable(e):
+                        raise
+                    delay = self._backoff(attempt, e)
+                finally:
+                    self._done()
+            time.sleep(delay)
+            attempt += 1
+
+
+class PooledChatOpenAI(ChatOpenAI):
+    """ChatOpenAI whose calls go through a shared ClientLimits.
+
+    Identical deterministic requests (same parameters, messages and
+    functions, temperature 0) made while one of them is in flight share that
+    single upstream call. Followers report no token usage; when streaming
+    they receive the whole answer as one token. If the leading request is
+    cancelled, its followers make the call again instead of failing.
+    """
+
+    limits: Any = Field(default_factory=ClientLimits, exclude=True)
+    coalesce: bool = True
+
+    def _request_key(self, messages, stop, kwargs):
+        return json.dumps([self._default_params, messages_to_dict(messages), stop, kwargs],
+                          sort_keys=True, default=str)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        generate = super()._generate
+        return self.limits.call(lambda: generate(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        generate = super()._agenerate
+
+        def call():
+            return generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+        if not self.coalesce or self.temperature:
+            return await self.limits.acall(call)
+        key = self._request_key(messages, stop, kwargs)
+        loop = asyncio.get_running_loop()
+        leader = self.limits.pending.get(key)
+        if leader is not None and leader.get_loop() is loop:
+            with self.limits._lock:
+                self.limits.coalesced += 1
+            try:
+                result = await asyncio.shield(leader)
+            except asyncio.CancelledError:
+                # the leader's caller went away (e.g. a discarded speculative run), not this one:
+                # retry, the first follower to get here leads the new call
+                task = asyncio.current_task()
+                if not leader.cancelled() or (hasattr(task, "cancelling") and task.cancelling()):
+                    raise
+                return await self._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            text = result.generations[0].text
+            if self.streaming and run_manager and text:
+                await run_manager.on_llm_new_token(text)
+            return ChatResult(generations=result.generations,
+                              llm_output={"token_usage": {"prompt_tokens": 0, "completion_tokens": 0},
+                                          "model_name": self.model_name, "coalesced": True})
+
+        future = self.limits.pending[key] = loop.create_future()
+        try:
+            result = await self.limits.acall(call)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # followers re-raise it; do not warn if there were none
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self.limits.pending.get(key) is future:
+                del self.limits.pending[key]
+
+
+_lock = threading.Lock()
+_limits = None
+_http_clients = None
+_llms = {}
+
+
+def shared_limits():
+    global _limits
+    with _lock:
+        if _limits is None:
+            _limits = ClientLimits.from_env()
+        return _limits
+
+
+def _use_pooled_http(llm, limits):
+    """Point `llm` at process-wide keep-alive HTTP connection pools (openai>=1)."""
+    global _http_clients
+    try:
+        import httpx
+        import openai
+    except ImportError:
+        return
+    if not hasattr(openai, "AsyncOpenAI"):
+        # openai<1 manages its own sessions
+        return
+    if _http_clients is None:
+        pool = httpx.Limits(max_connections=limits.max_in_flight,
+                            max_keepalive_connections=limits.max_in_flight, keepalive_expiry=60)
+        _http_clients = httpx.Client(limits=pool), httpx.AsyncClient(limits=pool)
+    params = dict(api_key=llm.openai_api_key, organization=llm.openai_organization,
+                  base_url=llm.openai_api_base, timeout=llm.request_timeout,
+                  # retries are ours, see ClientLimits
+                  max_retries=0)
+    llm.client = openai.OpenAI(http_client=_http_clients[0], **params).chat.completions
+    llm.async_client = openai.AsyncOpenAI(http_client=_http_clients[1], **params).chat.completions
+
+
+def build_llm(streaming=False):
+    """The process-wide chat model for `streaming`; build every chain and agent on it.
+
+    OPENAI_API_BASE points it at another endpoint (e.g. mock_openai.py);
+    BOOKIT_LLM_MAX_IN_FLIGHT, BOOKIT_LLM_RPS and BOOKIT_LLM_RETRIES tune the limits.
+    """
+    limits = shared_limits()
+    with _lock:
+        llm = _llms.get(streaming)
+        if llm is None:
+            # Load environment variables from .env file
+            load_dotenv()
+            llm = PooledChatOpenAI(model_name='gpt-3.5-turbo',
+                                   temperature=0,
+                                   max_tokens=256,
+                                   streaming=streaming,
+                                   request_timeout=30,
+                                   max_retries=0,
+                                   openai_api_key=os.environ.get('OPENAI_API_KEY'),
+                                   limits=limits)
+            _use_pooled_http(llm, limits)
+            _llms[streaming] = llm
+        return llm
+
+
+async def _exercise(llm, requests, distinct):
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(llm.agenerate([[HumanMessage(content=f"What time do you open? ({i % distinct})")]])
+          for i in range(requests)),
+        return_exceptions=True)
+    errors = [repr(r) for r in results if isinstance(r, BaseException)]
+    return {"requests": requests, "distinct": distinct, "seconds": round(time.perf_counter() - started, 3),
+            "errors": len(errors), "first_error": errors[0] if errors else None, **llm.limits.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fire concurrent requests through the shared client and print its counters; "
+                    "run against mock_openai.py by setting OPENAI_API_BASE")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--distinct", type=int, default=10, help="number of different prompts")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(_exercise(build_llm(), args.requests, args.distinct))))
+
+
+if __name__ == "__main__":
+    main()
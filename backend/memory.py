@@ -0,0 +1,124 @@
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+# langchain_core rather than langchain.memory: importing any langchain.memory
+# module loads the whole package (chains, SQL and Redis histories, ...), over
+# a second of every process's start
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.memory import BaseMemory
+from langchain_core.messages import BaseMessage, SystemMessage, get_buffer_string
+from langchain_core.pydantic_v1 import BaseModel, Field
+
+from slots import describe_slots, extract_slots
+
+# memory modes selectable with the BOOKIT_MEMORY environment variable
+MEMORY_MODES = ('budget', 'buffer')
+DEFAULT_MAX_TOKENS = 600
+DEFAULT_WINDOW_TURNS = 6
+
+
+def approx_token_count(text):
+    # ~4 characters per token for English; avoids pulling in a tokenizer
+    return len(text) // 4 + 1
+
+
+class MessageList(BaseChatMessageHistory, BaseModel):
+    """In-memory chat history, as langchain.memory.ChatMessageHistory."""
+
+    messages: List[BaseMessage] = Field(default_factory=list)
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.messages.append(message)
+
+    def clear(self) -> None:
+        self.messages = []
+
+
+class TokenBudgetMemory(BaseMemory):
+    """Sliding-window chat memory with a hard prompt token budget.
+
+    Keeps at most `window_turns` exchanges and drops the oldest messages once
+    `max_token_limit` is exceeded. Booking details the guest gave (party size,
+    date, name) are kept as a one-line summary so they survive the window.
+    Each message is counted once when it is added, never re-tokenized.
+    """
+
+    chat_memory: BaseChatMessageHistory = Field(default_factory=MessageList)
+    memory_key: str = "history"
+    input_key: Optional[str] = None
+    return_messages: bool = False
+    max_token_limit: int = DEFAULT_MAX_TOKENS
+    window_turns: int = DEFAULT_WINDOW_TURNS
+    token_counter: Callable[[str], int] = approx_token_count
+    slots: Dict[str, Any] = Field(default_factory=dict)
+    token_counts: List[int] = Field(default_factory=list)
+    total_tokens: int = 0
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        messages = list(self.chat_memory.messages)
+        summary = describe_slots(self.slots)
+        if summary:
+            messages.insert(0, SystemMessage(content=summary))
+        if self.return_messages:
+            return {self.memory_key: messages}
+        return {self.memory_key: get_buffer_string(messages)}
+
+    def _get_input_output(self, inputs: Dict[str, Any], outputs: Dict[str, str]):
+        input_key = self.input_key
+        if input_key is None:
+            keys = set(inputs) - {self.memory_key, "stop"}
+            if len(keys) != 1:
+                raise ValueError(f"One input key expected got {sorted(keys)}")
+            input_key = keys.pop()
+        if len(outputs) != 1:
+            raise ValueError(f"One output key expected, got {outputs.keys()}")
+        return inputs[input_key], next(iter(outputs.values()))
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        input_str, output_str = self._get_input_output(inputs, outputs)
+        self.slots.update(extract_slots(input_str))
+        self.chat_memory.add_user_message(input_str)
+        self.chat_memory.add_ai_message(output_str)
+        for message in self.chat_memory.messages[len(self.token_counts):]:
+            count = self.token_counter(message.content)
+            self.token_counts.append(count)
+            self.total_tokens += count
+        self._prune()
+
+    def _prune(self):
+        messages = self.chat_memory.messages
+        budget = self.max_token_limit - self.token_counter(describe_slots(self.slots))
+        while messages and (len(messages) > 2 * self.window_turns or self.total_tokens > budget):
+            messages.pop(0)
+            self.total_tokens -= self.token_counts.pop(0)
+
+    def clear(self) -> None:
+        self.chat_memory.clear()
+        self.slots.clear()
+        self.token_counts.clear()
+        self.total_tokens = 0
+
+
+def memory_tokens(memory):
+    """Current size of a chat memory in tokens."""
+    if isinstance(memory, TokenBudgetMemory):
+        return memory.total_tokens
+    return sum(approx_token_count(str(m.content)) for m in memory.chat_memory.messages)
+
+
+def make_memory(memory_key, mode=None, input_key=None, **kwargs):
+    """Build the chat memory for `memory_key` in the configured mode.
+
+    `input_key` names the guest message when the prompt has several inputs.
+    """
+    mode = mode or os.environ.get('BOOKIT_MEMORY', 'budget')
+    if mode == 'buffer':
+        from langchain.memory import ConversationBufferMemory
+        return ConversationBufferMemory(memory_key=memory_key, input_key=input_key, return_messages=True)
+    if mode == 'budget':
+        return TokenBudgetMemory(memory_key=memory_key, input_key=input_key, return_messages=True, **kwargs)
+    raise ValueError(f"unknown memory mode {mode!r}, expected one of {MEMORY_MODES}")
@@ -0,0 +1,134 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Minimal local stand-in for the OpenAI chat completions endpoint, to exercise
+# llm_client.py (connection reuse, rate limits, retries, coalescing) without
+# network access: OPENAI_API_BASE=http://127.0.0.1:8900/v1
+
+
+class MockStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def as_dict(self):
+        return {"requests": self.requests, "rate_limited": self.rate_limited, "connections": self.connections,
+                "max_in_flight": self.max_in_flight}
+
+
+def make_handler(stats, latency, rate_limit_every, reply):
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive, so pooled clients reuse their connections
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            stats.add(connections=1)
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, body, headers=()):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                self._send_json(200, stats.as_dict())
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            stats.add(requests=1, in_flight=1)
+            try:
+                if rate_limit_every and stats.requests % rate_limit_every == 0:
+                    stats.add(rate_limited=1)
+                    self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                                    [("Retry-After", "0.05")])
+                    return
+                time.sleep(latency)
+                self._complete(request)
+            finally:
+                stats.add(in_flight=-1)
+
+        def _complete(self, request):
+            model = request.get("model", "gpt-3.5-turbo")
+            prompt_tokens = sum(len(str(m.get("content") or "").split()) for m in request.get("messages", []))
+            if not request.get("stream"):
+                self._send_json(200, {
+                    "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": reply}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(reply.split()),
+                              "total_tokens": prompt_tokens + len(reply.split())}})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            tokens = [{"role": "assistant", "content": ""}] + [{"content": word + " "} for word in reply.split()]
+            for i, delta in enumerate(tokens + [{}]):
+                chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": model, "choices": [{"index": 0, "delta": delta,
+                                                      "finish_reason": None if i < len(tokens) else "stop"}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+
+        def _write_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8900, latency=0.05, rate_limit_every=0,
+          reply="We are open every evening from 6pm to 11pm."):
+    """Start the mock in a background thread and return (server, stats)."""
+    stats = MockStats()
+    server = ThreadingHTTPServer((host, port), make_handler(stats, latency, rate_limit_every, reply))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="mock-openai").start()
+    return server, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per completion")
+    parser.add_argument("--rate-limit-every", type=int, default=0,
+                        help="answer every Nth request with a 429")
+    args = parser.parse_args()
+    server, _ = serve(args.host, args.port, args.latency, args.rate_limit_every)
+    print(f"mock OpenAI API on http://{args.host}:{args.port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
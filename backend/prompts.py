@@ -0,0 +1,146 @@
+import datetime
+import re
+import threading
+from typing import Dict, List, Optional
+
+from langchain.prompts.chat import (
+    BaseMessagePromptTemplate,
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    MessagesPlaceholder,
+    SystemMessagePromptTemplate,
+)
+from langchain.schema.messages import BaseMessage, HumanMessage, SystemMessage
+
+from memory import approx_token_count
+
+# Prompt compilation. The system prompts are written as indented
+# triple-quoted strings; `compact` removes the indentation and blank lines,
+# which are sent (and billed) as tokens on every call. A system prompt whose
+# only variable is `{current_date}` is rendered and counted once per prompt and
+# day in `prefix_cache` and the same message is reused by every turn, so
+# long-running processes move to the new date at midnight without rebuilding
+# their chains. `prompt_sections` splits the tokens of a call into system,
+# history and user.
+
+SECTIONS = ("system", "history", "user")
+
+
+def compact(template: str) -> str:
+    """`template` without indentation, blank lines or runs of spaces."""
+    lines = (re.sub(r"[ \t]+", " ", line).strip() for line in template.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+class PrefixCache:
+    """Rendered system prefixes by (prompt name, date), with their token counts.
+
+    Entries older than the day before the newest date asked for are dropped,
+    so the cache holds about two prefixes per prompt.
+    """
+
+    def __init__(self, token_counter=approx_token_count):
+        self.token_counter = token_counter
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        # id of a cached message -> its token count, for prompt_sections
+        self._tokens = {}
+        self._newest = None
+        self._lock = threading.Lock()
+
+    def get(self, name, template, date) -> SystemMessage:
+        entry = self._entries.get((name, date))
+        if entry is not None:
+            self.hits += 1
+            return entry
+        with self._lock:
+            entry = self._entries.get((name, date))
+            if entry is None:
+                self.misses += 1
+                entry = SystemMessage(content=template.format(current_date=date))
+                self._entries[(name, date)] = entry
+                self._tokens[id(entry)] = self.token_counter(entry.content)
+                if self._newest is None or date > self._newest:
+                    self._newest = date
+                    self._evict(date - datetime.timedelta(days=1))
+        return entry
+
+    def _evict(self, oldest):
+        for key in [key for key in self._entries if key[1] < oldest]:
+            self._tokens.pop(id(self._entries.pop(key)), None)
+
+    def tokens(self, message: BaseMessage) -> int:
+        count = self._tokens.get(id(message))
+        if count is None:
+            count = approx_token_count(str(message.content))
+        return count
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'prefixes': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens.clear()
+            self._newest = None
+            self.hits = 0
+            self.misses = 0
+
+
+prefix_cache = PrefixCache()
+
+
+class SystemPrefix(BaseMessagePromptTemplate):
+    """System message rendered from `template` once per day and reused from `prefix_cache`.
+
+    `current_date` pins the date; by default it is today's.
+    """
+
+    name: str
+    template: str
+    current_date: Optional[datetime.date] = None
+
+    @property
+    def input_variables(self) -> List[str]:
+        return []
+
+    def format_messages(self, **kwargs) -> List[BaseMessage]:
+        return [prefix_cache.get(self.name, self.template, self.current_date or datetime.date.today())]
+
+
+def compile_prompt(name, system_template, history_key=None, human_template="{question}", current_date=None):
+    """ChatPromptTemplate of a compacted system prompt, the chat history `history_key` and the guest message.
+
+    System prompts with variables other than `{current_date}` (e.g. the
+    intent prompt, which quotes the question) are compacted but still
+    rendered on every call.
+    """
+    system_template = compact(system_template)
+    if set(re.findall(r"{(\w+)}", system_template)) <= {"current_date"}:
+        system = SystemPrefix(name=name, template=system_template, current_date=current_date)
+    else:
+        system = SystemMessagePromptTemplate.from_template(system_template)
+    messages = [system]
+    if history_key is not None:
+        # The `variable_name` here is what must align with memory
+        messages.append(MessagesPlaceholder(variable_name=history_key))
+    messages.append(HumanMessagePromptTemplate.from_template(human_template))
+    return ChatPromptTemplate(messages=messages)
+
+
+def prompt_sections(messages: List[BaseMessage]) -> Dict[str, int]:
+    """Prompt tokens of one chat model call: leading system prompt, history (incl. slot summary) and guest message."""
+    sections = dict.fromkeys(SECTIONS, 0)
+    last = len(messages) - 1
+    for i, message in enumerate(messages):
+        if i == 0 and isinstance(message, SystemMessage):
+            section = "system"
+        elif i == last and isinstance(message, HumanMessage):
+            section = "user"
+        else:
+            section = "history"
+        sections[section] += prefix_cache.tokens(message)
+    return sections
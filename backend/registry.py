@@ -0,0 +1,116 @@
+import argparse
+import asyncio
+import importlib
+import json
+import threading
+import time
+
+# Lazy construction of the conversation chains. Prompts, agents and
+# memoryless chains are built once per process on first use and shared by
+# every session (`ChainRegistry`); the per-session chains, which own a
+# memory, are only built when their branch is first used (`Lazy`). Only the
+# standard library is imported here, so `python registry.py` can time a cold
+# start of a flow.
+
+
+def _key(arg):
+    try:
+        hash(arg)
+        return arg
+    except TypeError:
+        # e.g. pydantic models; the built part keeps the object alive
+        return id(arg)
+
+
+class ChainRegistry:
+    """Process-wide cache of shared chain parts, each built by its factory on first use.
+
+    `get(name, *args)` calls the factory registered under `name` once per
+    distinct `args` (e.g. the LLM, the current date) and returns the same
+    object afterwards. `build_seconds` records how long each first build
+    took, imports included.
+    """
+
+    def __init__(self):
+        self.factories = {}
+        self.build_seconds = {}
+        self._parts = {}
+        self._lock = threading.RLock()
+
+    def register(self, name):
+        def decorator(factory):
+            self.factories[name] = factory
+            return factory
+        return decorator
+
+    def get(self, name, *args):
+        key = (name,) + tuple(_key(arg) for arg in args)
+        part = self._parts.get(key)
+        if part is None:
+            with self._lock:
+                part = self._parts.get(key)
+                if part is None:
+                    started = time.perf_counter()
+                    part = self._parts[key] = self.factories[name](*args)
+                    self.build_seconds.setdefault(name, time.perf_counter() - started)
+        return part
+
+    def clear(self):
+        with self._lock:
+            self._parts.clear()
+            self.build_seconds.clear()
+
+
+class Lazy:
+    """Stands in for the object `factory()` returns, building it on first attribute access."""
+
+    __slots__ = ("_factory", "_target")
+
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_target", None)
+
+    @property
+    def built(self):
+        return self._target is not None
+
+    def resolve(self):
+        if self._target is None:
+            object.__setattr__(self, "_target", self._factory())
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+
+def cold_start(flow_name, latency=0.0):
+    """Seconds to import a flow module, build its first dispatcher and answer a first turn."""
+    started = time.perf_counter()
+    flow = importlib.import_module("intent_and_functions" if flow_name == "functions" else "intent")
+    imported = time.perf_counter()
+    from fake_llm import FakeChatModel
+    llm = FakeChatModel(latency=latency)
+    built_at = time.perf_counter()
+    dispatcher = flow.build_dispatcher(llm)
+    built = time.perf_counter()
+    asyncio.run(dispatcher.handle("Hi, I'd like to book a table for 4 on Friday"))
+    answered = time.perf_counter()
+    return {
+        "flow": flow_name,
+        "import_s": round(imported - started, 4),
+        "first_dispatcher_s": round(built - built_at, 4),
+        "first_turn_s": round(answered - built, 4),
+        "parts_s": {name: round(seconds, 4) for name, seconds in flow.registry.build_seconds.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the cold start of a bookit flow in this fresh process")
+    parser.add_argument("--flow", choices=["functions", "intent"], default="functions")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per fake LLM call")
+    args = parser.parse_args()
+    print(json.dumps(cold_start(args.flow, args.latency)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+from fast_intent import FastIntentClassifier
+
+# Offline replay of guest messages through the router, e.g. to re-label
+# intents after a prompt change or to backfill reservations.
+#
+# Input is JSONL, one conversation per line, read incrementally:
+#   {"id": "a1", "message": "table for 4 on friday"}
+#   {"id": "a2", "messages": ["I need to change my booking", "It's under Alice"]}
+# "messages" items may also be {"role": ..., "content": ...}; only guest
+# ("user"/"human") turns are replayed. Each conversation gets a fresh
+# dispatcher and its turns run in order; conversations run concurrently.
+#
+# Output is JSONL in completion order, one line per input line, carrying the
+# input byte `offset`. With --checkpoint, the offset below which every line
+# is done is saved as results are written; a rerun with the same checkpoint
+# and output resumes there, drops a trailing line left unfinished by a crash
+# and skips lines already in the output.
+#
+#   python replay.py transcripts.jsonl --output relabeled.jsonl --classify-only \
+#       --concurrency 16 --checkpoint relabel.ckpt
+
+GUEST_ROLES = ("user", "human", "guest")
+
+
+def read_records(path, start=0):
+    """Yield (offset, end, record) for every non-blank line from byte `start` on."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            end = offset + len(line)
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    record = {"error": f"invalid json: {e}"}
+                yield offset, end, record
+            offset = end
+
+
+def guest_messages(record):
+    if "messages" not in record:
+        return [record["message"]]
+    messages = []
+    for message in record["messages"]:
+        if isinstance(message, str):
+            messages.append(message)
+        elif message.get("role", "user") in GUEST_ROLES:
+            messages.append(message["content"])
+    return messages
+
+
+def load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)["offset"]
+    return 0
+
+
+def save_checkpoint(path, offset):
+    # write-then-rename, so a crash never leaves a truncated checkpoint
+    with open(path + ".tmp", "w") as f:
+        json.dump({"offset": offset}, f)
+    os.replace(path + ".tmp", path)
+
+
+def truncate_partial_line(path, chunk=1 << 16):
+    """Cut `path` back to its last newline, dropping a line the crash left unfinished."""
+    with open(path, 'r+b') as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - chunk)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                f.truncate(start + newline + 1)
+                return
+            end = start
+        f.truncate(0)
+
+
+def done_offsets(output_path, start):
+    """Offsets at or after `start` already present in a previous run's output."""
+    done = set()
+    if output_path and os.path.exists(output_path):
+        with open(output_path) as f:
+            for line in f:
+                try:
+                    offset = json.loads(line).get("offset", -1)
+                except json.JSONDecodeError:
+                    # a line cut short by the crash
+                    continue
+                if offset >= start:
+                    done.add(offset)
+    return done
+
+
+class Replay:
+    """Runs conversations from `read_records` through fresh dispatchers, `concurrency` at a time.
+
+    With `classify_only`, every guest message is classified (intent chain or
+    local classifier) and no branch runs, so nothing is booked.
+    """
+
+    def __init__(self, dispatcher_factory, out, concurrency=8, classify_only=False, checkpoint_path=None,
+                 checkpoint_every=100):
+        self.dispatcher_factory = dispatcher_factory
+        self.out = out
+        self.concurrency = concurrency
+        self.classify_only = classify_only
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.intents = Counter()
+        self.conversations = 0
+        self.turns = 0
+        self.errors = 0
+        self.skipped = 0
+        # input lines started but not written out yet: offset -> end
+        self._pending = {}
+        self._read_upto = 0
+
+    async def _conversation(self, record):
+        messages = guest_messages(record)
+        dispatcher = self.dispatcher_factory()
+        turns = []
+        for message in messages:
+            if self.classify_only:
+                prediction = await dispatcher.classify(message)
+                turns.append({"message": message, "intent": prediction.intent, "source": prediction.source})
+            else:
+                turn = await dispatcher.handle(message)
+                turns.append({"message": message, "intent": turn.intent, "reply": turn.reply})
+        return turns
+
+    async def _process(self, offset, record):
+        result = {"offset": offset}
+        if "id" in record:
+            result["id"] = record["id"]
+        try:
+            if "error" in record:
+                raise ValueError(record["error"])
+            result["turns"] = await self._conversation(record)
+        except Exception as e:
+            result["error"] = str(e)
+            self.errors += 1
+        else:
+            self.turns += len(result["turns"])
+            self.intents.update(turn["intent"] for turn in result["turns"])
+        self.out.write(json.dumps(result) + "\n")
+        self.conversations += 1
+        del self._pending[offset]
+        if self.checkpoint_path and self.conversations % self.checkpoint_every == 0:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.out.flush()
+        save_checkpoint(self.checkpoint_path, min(self._pending, default=self._read_upto))
+
+    async def _worker(self, queue):
+        while (item := await queue.get()) is not None:
+            await self._process(*item)
+
+    async def run(self, records, skip=()):
+        queue = asyncio.Queue(maxsize=2 * self.concurrency)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        started = time.perf_counter()
+        try:
+            for offset, end, record in records:
+                self._read_upto = end
+                if offset in skip:
+                    self.skipped += 1
+                    continue
+                self._pending[offset] = end
+                await queue.put((offset, record))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            if self.checkpoint_path:
+                self.checkpoint()
+            else:
+                self.out.flush()
+        return self.summary(time.perf_counter() - started)
+
+    def summary(self, elapsed):
+        return {
+            "conversations": self.conversations,
+            "turns": self.turns,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "elapsed_s": round(elapsed, 3),
+            "conversations_per_s": round(self.conversations / elapsed, 2) if elapsed else None,
+            "turns_per_s": round(self.turns / elapsed, 2) if elapsed else None,
+            "intents": dict(self.intents.most_common()),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay JSONL guest messages or transcripts through the router")
+    parser.add_argument("input", help="JSONL file, one conversation per line")
+    parser.add_argument("--output", help="JSONL results (default stdout); appended to when resuming")
+    parser.add_argument("--flow", choices=["functions", "intent"], default="functions")
+    parser.add_argument("--concurrency", type=int, default=8, help="conversations processed at once")
+    parser.add_argument("--classify-only", action="store_true", help="only classify the messages, run no branch")
+    parser.add_argument("--checkpoint", help="file holding the input offset to resume from")
+    parser.add_argument("--fake-llm", action="store_true", help="use the scripted FakeChatModel (no API calls)")
+    args = parser.parse_args()
+
+    if args.flow == "functions":
+        import intent_and_functions as flow
+    else:
+        import intent as flow
+    if args.fake_llm:
+        from fake_llm import FakeChatModel
+        llm = FakeChatModel(latency=0.0)
+    else:
+        from llm_client import build_llm
+        llm = build_llm()
+    classifier = FastIntentClassifier()
+
+    start = load_checkpoint(args.checkpoint)
+    skip = done_offsets(args.output, start) if start or args.checkpoint else set()
+    if args.output and (start or skip):
+        truncate_partial_line(args.output)
+    out = open(args.output, "a" if start or skip else "w") if args.output else sys.stdout
+    replay = Replay(lambda: flow.build_dispatcher(llm, classifier), out, args.concurrency,
+                    args.classify_only, args.checkpoint)
+    try:
+        summary = asyncio.run(replay.run(read_records(args.input, start), skip))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    summary["resumed_from"] = start
+    summary["classifier"] = classifier.stats()
+    print(json.dumps(summary), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
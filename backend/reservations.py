@@ -0,0 +1,159 @@
+import datetime
+import os
+import threading
+from dataclasses import dataclass
+from typing import List, Optional
+
+from capacity import CapacityCalendar
+
+# number of seats the restaurant can take on a single evening
+DEFAULT_CAPACITY = 15
+
+
+@dataclass
+class Reservation:
+    name: str
+    date: datetime.date
+    seats: int
+
+
+def to_date(value, today=None):
+    """Normalize a tool `date` argument into a datetime.date.
+
+    Accepts date objects, ISO strings ('2023-12-24'), YYYYMMDD integers and
+    plain day-of-month integers, which resolve to the next such day from today.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    if isinstance(value, str):
+        value = value.strip()
+        if not value.isdigit():
+            return datetime.date.fromisoformat(value)
+        value = int(value)
+    value = int(value)
+    if value > 10000000:
+        return datetime.date(value // 10000, value // 100 % 100, value % 100)
+    if not 1 <= value <= 31:
+        raise ValueError(f"invalid date: {value}")
+    today = today or datetime.date.today()
+    year, month = today.year, today.month
+    if value < today.day:
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    # skip months that do not have that day (e.g. the 31st)
+    while True:
+        try:
+            return datetime.date(year, month, value)
+        except ValueError:
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def name_key(name):
+    return " ".join(name.split()).casefold()
+
+
+def open_store(capacity=DEFAULT_CAPACITY, path=None):
+    """The in-memory store, or the SQLite one shared across processes if `path` or BOOKIT_DB is set."""
+    path = path or os.environ.get('BOOKIT_DB')
+    if not path:
+        return ReservationStore(capacity)
+    from reservations_db import SqliteReservationStore
+    return SqliteReservationStore(path, capacity)
+
+
+class ReservationStore:
+    """Thread-safe in-memory reservations with per-date capacity.
+
+    Booked seats are kept as a running total per date so availability is a
+    single dict lookup, and reservations are indexed by (name, date) for the
+    edit and cancel flows. Every write takes the lock of the date(s) it touches,
+    so concurrent sessions cannot overbook the same evening. A CapacityCalendar
+    mirrors the free seats per date for alternative-date searches.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.calendar = CapacityCalendar(capacity)
+        self._booked = {}
+        self._reservations = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, date):
+        lock = self._locks.get(date)
+        if lock is None:
+            with self._locks_guard:
+                lock = self._locks.setdefault(date, threading.Lock())
+        return lock
+
+    def available(self, date) -> int:
+        date = to_date(date)
+        return self.capacity - self._booked.get(date, 0)
+
+    def find(self, name, date) -> Optional[Reservation]:
+        return self._reservations.get((name_key(name), to_date(date)))
+
+    def nearest_available(self, date, seats, k=3) -> List[datetime.date]:
+        """The `k` dates closest to `date` with at least `seats` free."""
+        return self.calendar.nearest(to_date(date), seats, k)
+
+    def _set_booked(self, date, booked):
+        # caller holds the date's lock
+        self._booked[date] = booked
+        self.calendar.set_free(date, self.capacity - booked)
+
+    def book(self, date, seats, name) -> Optional[Reservation]:
+        """Book `seats` on `date`, or return None if full or already booked."""
+        date = to_date(date)
+        if seats <= 0:
+            raise ValueError("seats must be positive")
+        key = (name_key(name), date)
+        with self._lock(date):
+            booked = self._booked.get(date, 0)
+            if key in self._reservations or booked + seats > self.capacity:
+                return None
+            reservation = Reservation(name=name, date=date, seats=seats)
+            self._set_booked(date, booked + seats)
+            self._reservations[key] = reservation
+            return reservation
+
+    def cancel(self, name, date) -> Optional[Reservation]:
+        date = to_date(date)
+        with self._lock(date):
+            reservation = self._reservations.pop((name_key(name), date), None)
+            if reservation is not None:
+                self._set_booked(date, self._booked[date] - reservation.seats)
+            return reservation
+
+    def edit(self, name, date, new_date=None, seats=None) -> Optional[Reservation]:
+        """Move and/or resize a reservation, or return None if not possible.
+
+        The original booking is left untouched when the new date has no room.
+        """
+        date = to_date(date)
+        new_date = to_date(new_date) if new_date is not None else date
+        if seats is not None and seats <= 0:
+            raise ValueError("seats must be positive")
+        old_key, new_key = (name_key(name), date), (name_key(name), new_date)
+        # always take date locks in the same order to avoid deadlocks
+        locks = [self._lock(d) for d in sorted({date, new_date})]
+        for lock in locks:
+            lock.acquire()
+        try:
+            current = self._reservations.get(old_key)
+            if current is None or (new_key != old_key and new_key in self._reservations):
+                return None
+            seats = current.seats if seats is None else seats
+            freed = current.seats if new_date == date else 0
+            if self._booked.get(new_date, 0) - freed + seats > self.capacity:
+                return None
+            del self._reservations[old_key]
+            self._set_booked(date, self._booked[date] - current.seats)
+            updated = Reservation(name=current.name, date=new_date, seats=seats)
+            self._set_booked(new_date, self._booked.get(new_date, 0) + seats)
+            self._reservations[new_key] = updated
+            return updated
+        finally:
+            for lock in reversed(locks):
+                lock.release()
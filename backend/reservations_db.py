@@ -0,0 +1,229 @@
+import datetime
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from typing import List, Optional
+
+from capacity import CapacityCalendar
+from reservations import DEFAULT_CAPACITY, Reservation, name_key, to_date
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reservations (
+    name_key TEXT NOT NULL,
+    date TEXT NOT NULL,
+    name TEXT NOT NULL,
+    seats INTEGER NOT NULL,
+    PRIMARY KEY (name_key, date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS reservations_date ON reservations (date);
+CREATE TABLE IF NOT EXISTS date_totals (
+    date TEXT PRIMARY KEY,
+    booked INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+# statements are kept as constants so sqlite3's per-connection statement
+# cache reuses their compiled form
+SELECT_BOOKED = "SELECT booked FROM date_totals WHERE date = ?"
+SELECT_RESERVATION = "SELECT name, seats FROM reservations WHERE name_key = ? AND date = ?"
+INSERT_RESERVATION = "INSERT INTO reservations (name_key, date, name, seats) VALUES (?, ?, ?, ?)"
+DELETE_RESERVATION = "DELETE FROM reservations WHERE name_key = ? AND date = ?"
+ADD_BOOKED = ("INSERT INTO date_totals (date, booked) VALUES (?, ?) "
+              "ON CONFLICT (date) DO UPDATE SET booked = booked + excluded.booked")
+
+
+class SqliteReservationStore:
+    """Reservation store persisted in SQLite, shared by every process using `path`.
+
+    Same interface as ReservationStore. The database runs in WAL mode so reads
+    never wait for writers. Availability is a primary-key lookup in a per-date
+    running total kept in the same transactions as the reservations. Reads go
+    through a small connection pool; writes are queued to one writer thread
+    that applies everything waiting in a single BEGIN IMMEDIATE transaction
+    (group commit), which also serializes check-and-book across processes.
+
+    The CapacityCalendar is loaded from the database and refreshed for every
+    date this process writes; candidates it proposes are re-read before being
+    returned, so bookings made by other processes are never offered as free.
+    """
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, pool_size=4, max_batch=64):
+        self.path = path
+        self.capacity = capacity
+        self.max_batch = max_batch
+        self._pool = queue.SimpleQueue()
+        self._pool_size = pool_size
+        self._writes = queue.SimpleQueue()
+
+        writer = self._connect()
+        writer.executescript(SCHEMA)
+        self.calendar = CapacityCalendar(capacity)
+        for date, booked in writer.execute("SELECT date, booked FROM date_totals"):
+            self.calendar.set_free(datetime.date.fromisoformat(date), capacity - booked)
+        self._writer = threading.Thread(target=self._write_loop, args=(writer,), daemon=True,
+                                        name="reservations-writer")
+        self._writer.start()
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, cached_statements=64)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _read(self, sql, args):
+        conn = self._pool.get()
+        try:
+            return conn.execute(sql, args).fetchone()
+        finally:
+            self._pool.put(conn)
+
+    def available(self, date) -> int:
+        row = self._read(SELECT_BOOKED, (to_date(date).isoformat(),))
+        return self.capacity - (row[0] if row else 0)
+
+    def find(self, name, date) -> Optional[Reservation]:
+        date = to_date(date)
+        row = self._read(SELECT_RESERVATION, (name_key(name), date.isoformat()))
+        return Reservation(name=row[0], date=date, seats=row[1]) if row else None
+
+    def nearest_available(self, date, seats, k=3) -> List[datetime.date]:
+        """The `k` dates closest to `date` with at least `seats` free."""
+        date = to_date(date)
+        while True:
+            dates = self.calendar.nearest(date, seats, k)
+            # another process may have booked some of them since we last looked
+            if all(self._refresh(candidate) >= seats for candidate in dates):
+                return dates
+
+    def _refresh(self, date):
+        free = self.available(date)
+        self.calendar.set_free(date, free)
+        return free
+
+    def book(self, date, seats, name) -> Optional[Reservation]:
+        """Book `seats` on `date`, or return None if full or already booked."""
+        if seats <= 0:
+            raise ValueError("seats must be positive")
+        date = to_date(date)
+        reservation = self._submit(self._book, date, seats, name)
+        self._refresh(date)
+        return reservation
+
+    def cancel(self, name, date) -> Optional[Reservation]:
+        date = to_date(date)
+        reservation = self._submit(self._cancel, name, date)
+        self._refresh(date)
+        return reservation
+
+    def edit(self, name, date, new_date=None, seats=None) -> Optional[Reservation]:
+        """Move and/or resize a reservation, or return None if not possible."""
+        if seats is not None and seats <= 0:
+            raise ValueError("seats must be positive")
+        date = to_date(date)
+        new_date = to_date(new_date) if new_date is not None else date
+        reservation = self._submit(self._edit, name, date, new_date, seats)
+        self._refresh(date)
+        self._refresh(new_date)
+        return reservation
+
+    def close(self):
+        self._writes.put(None)
+        self._writer.join()
+        for _ in range(self._pool_size):
+            self._pool.get().close()
+
+    # write operations, run on the writer thread inside the batch transaction
+
+    def _submit(self, operation, *args):
+        future = Future()
+        self._writes.put((operation, args, future))
+        return future.result()
+
+    def _write_loop(self, conn):
+        while True:
+            item = self._writes.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._writes.put(None)
+                    break
+                batch.append(item)
+            self._apply(conn, batch)
+        conn.close()
+
+    def _apply(self, conn, batch):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for operation, args, future in batch:
+                conn.execute("SAVEPOINT operation")
+                try:
+                    results.append((future, operation(conn, *args), None))
+                    conn.execute("RELEASE operation")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO operation")
+                    conn.execute("RELEASE operation")
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _booked(self, conn, date):
+        row = conn.execute(SELECT_BOOKED, (date.isoformat(),)).fetchone()
+        return row[0] if row else 0
+
+    def _book(self, conn, date, seats, name):
+        key = name_key(name)
+        if conn.execute(SELECT_RESERVATION, (key, date.isoformat())).fetchone():
+            return None
+        if self._booked(conn, date) + seats > self.capacity:
+            return None
+        conn.execute(INSERT_RESERVATION, (key, date.isoformat(), name, seats))
+        conn.execute(ADD_BOOKED, (date.isoformat(), seats))
+        return Reservation(name=name, date=date, seats=seats)
+
+    def _cancel(self, conn, name, date):
+        key = name_key(name)
+        row = conn.execute(SELECT_RESERVATION, (key, date.isoformat())).fetchone()
+        if row is None:
+            return None
+        conn.execute(DELETE_RESERVATION, (key, date.isoformat()))
+        conn.execute(ADD_BOOKED, (date.isoformat(), -row[1]))
+        return Reservation(name=row[0], date=date, seats=row[1])
+
+    def _edit(self, conn, name, date, new_date, seats):
+        key = name_key(name)
+        row = conn.execute(SELECT_RESERVATION, (key, date.isoformat())).fetchone()
+        if row is None:
+            return None
+        if new_date != date and conn.execute(SELECT_RESERVATION, (key, new_date.isoformat())).fetchone():
+            return None
+        current_name, current_seats = row
+        seats = current_seats if seats is None else seats
+        freed = current_seats if new_date == date else 0
+        if self._booked(conn, new_date) - freed + seats > self.capacity:
+            return None
+        conn.execute(DELETE_RESERVATION, (key, date.isoformat()))
+        conn.execute(ADD_BOOKED, (date.isoformat(), -current_seats))
+        conn.execute(INSERT_RESERVATION, (key, new_date.isoformat(), current_name, seats))
+        conn.execute(ADD_BOOKED, (new_date.isoformat(), seats))
+        return Reservation(name=current_name, date=new_date, seats=seats)
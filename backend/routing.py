@@ -0,0 +1,86 @@
+import re
+
+from fast_intent import RULES
+from memory import TokenBudgetMemory
+
+# Mid-conversation routing. A guest stays in the branch their conversation
+# was routed to; each message is only checked locally for signs of a topic
+# switch, and only those messages go back to the intent LLM. When the branch
+# changes, the booking details collected so far move along with the guest.
+
+# phrases that announce a change of subject
+_SWITCH_MARKERS = re.compile(r"\b(actually|instead|never ?mind|forget (it|that|about)|on second thought|"
+                             r"scratch that|by the way|btw|one more thing|another question)\b")
+
+
+class TopicSwitchDetector:
+    """Cheap local check of whether a message may leave the current branch.
+
+    A message is suspect when it contains a change-of-subject phrase, matches
+    the keyword rules of another intent, or the classifier model gives
+    another intent at least `switch_confidence`.
+    """
+
+    def __init__(self, classifier=None, switch_confidence=0.75):
+        self.classifier = classifier
+        self.switch_confidence = switch_confidence
+        self.checks = 0
+        self.suspected = 0
+
+    def __call__(self, query, intent) -> bool:
+        self.checks += 1
+        suspected = self._suspect(query, intent)
+        self.suspected += suspected
+        return suspected
+
+    def _suspect(self, query, intent):
+        lowered = query.lower()
+        if _SWITCH_MARKERS.search(lowered):
+            return True
+        if any(rule_intent != intent and pattern.search(lowered) for rule_intent, pattern in RULES):
+            return True
+        if self.classifier is not None:
+            guess = self.classifier.predict(query)
+            if guess is not None and guess.intent != intent and guess.confidence >= self.switch_confidence:
+                return True
+        return False
+
+    def stats(self):
+        return {'checks': self.checks, 'suspected': self.suspected,
+                'recheck_rate': round(self.suspected / self.checks, 4) if self.checks else 0.0}
+
+
+def carry_slots(source, target):
+    """Copy the details `source` collected into `target`, without overwriting newer ones."""
+    slots = getattr(source, 'slots', None)
+    if not slots or not hasattr(target, 'slots'):
+        return
+    for key, value in slots.items():
+        target.slots.setdefault(key, value)
+
+
+class ChainBranch:
+    """Branch answered by an LLMChain taking the guest message as `question`.
+
+    Its `slots` are those of the chain's TokenBudgetMemory, so details carried
+    over from another branch appear in the prompt's summary line.
+    """
+
+    def __init__(self, chain, memory=None):
+        self.chain = chain
+        self.memory = memory
+        self._slots = {}
+
+    @property
+    def slots(self):
+        return self.memory.slots if isinstance(self.memory, TokenBudgetMemory) else self._slots
+
+    @slots.setter
+    def slots(self, value):
+        if isinstance(self.memory, TokenBudgetMemory):
+            self.memory.slots = value
+        else:
+            self._slots = value
+
+    async def __call__(self, query, callbacks=None):
+        return await self.chain.arun({"question": query}, callbacks=callbacks)
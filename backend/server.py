@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+
+from checkpoint import SpillStore, decode_state, encode_state, restore_session, session_state
+from fast_intent import FastIntentClassifier
+from instrumentation import Instrumentation
+from llm_client import build_llm
+from speculation import Speculation
+
+# Asyncio conversation server: one SessionDispatcher per guest session, all
+# sessions sharing one event loop, one LLM client and the reservation store.
+#
+# Protocol: newline-delimited JSON over TCP.
+#   -> {"session": "abc", "message": "table for 4 on friday"}
+# Every request names its session (a string or integer chosen by the client).
+#   <- {"session": "abc", "intent": "New", "reply": "...", "time_to_first_token": 0.41}
+# With "stream": true in the request, {"token": "...", "session": "abc"} lines
+# are sent as the reply is generated, before the final line. Token lines
+# start with the "token" key so relays can tell them apart without parsing.
+#
+# Sessions idle for `idle_seconds` are checkpointed to a SpillStore and
+# dropped from memory; their next message rebuilds them (see checkpoint.py).
+
+
+TOKEN_PREFIX = b'{"token": '
+
+
+def parse_request(line):
+    """The request object on `line`; ValueError if the line is not one."""
+    try:
+        request = json.loads(line)
+    except json.JSONDecodeError:
+        raise ValueError("invalid json") from None
+    if not isinstance(request, dict) or not isinstance(request.get("message"), str):
+        raise ValueError("invalid request")
+    # without one, every such guest would share a single session
+    if request.get("session") is None:
+        raise ValueError("missing session")
+    if not isinstance(request["session"], (str, int)):
+        raise ValueError("invalid request")
+    return request
+
+
+class SessionBusy(Exception):
+    """Raised when a session already has too many messages waiting."""
+
+
+@dataclass
+class Session:
+    dispatcher: object
+    semaphore: asyncio.Semaphore
+    pending: int = 0
+    last_seen: float = field(default_factory=time.monotonic)
+
+
+class SessionServer:
+    """Holds per-session conversation state keyed by session id.
+
+    `dispatcher_factory()` builds the dispatcher of a new session. At most
+    `max_concurrent` messages of a session are processed at a time (1 keeps
+    a guest's turns in order) and at most `max_pending` may wait behind them.
+    With a `spill` store, sessions idle for `idle_seconds` are moved there.
+    """
+
+    def __init__(self, dispatcher_factory, max_concurrent=1, max_pending=4, spill=None, idle_seconds=None,
+                 metrics=None):
+        self.dispatcher_factory = dispatcher_factory
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_pending
+        self.spill = spill
+        self.idle_seconds = idle_seconds
+        self.metrics = metrics
+        self.sessions = {}
+
+    def session(self, session_id) -> Session:
+        session = self.sessions.get(session_id)
+        if session is None:
+            started = time.perf_counter()
+            dispatcher = self.dispatcher_factory()
+            dispatcher.session_id = session_id
+            data = self.spill.pop(session_id) if self.spill is not None else None
+            if data is not None:
+                restore_session(dispatcher, decode_state(data))
+                if self.metrics is not None:
+                    self.metrics.session_resume_seconds.observe(time.perf_counter() - started)
+            session = Session(dispatcher, asyncio.Semaphore(self.max_concurrent))
+            self.sessions[session_id] = session
+        return session
+
+    def close_session(self, session_id):
+        self.sessions.pop(session_id, None)
+        if self.spill is not None:
+            self.spill.pop(session_id)
+
+    def spill_session(self, session_id):
+        """Checkpoint a session with no message in progress and drop it from memory."""
+        session = self.sessions.get(session_id)
+        if session is None or session.pending or self.spill is None:
+            return False
+        self.spill.put(session_id, encode_state(session_state(session.dispatcher)))
+        del self.sessions[session_id]
+        if self.metrics is not None:
+            self.metrics.sessions_spilled.inc()
+        return True
+
+    def spill_idle(self, idle_seconds):
+        """Spill every session that has been idle for `idle_seconds`; returns how many."""
+        cutoff = time.monotonic() - idle_seconds
+        return sum(self.spill_session(session_id) for session_id, session in list(self.sessions.items())
+                   if session.last_seen <= cutoff)
+
+    async def _spill_loop(self):
+        while True:
+            await asyncio.sleep(max(self.idle_seconds / 2, 0.1))
+            self.spill_idle(self.idle_seconds)
+
+    async def handle(self, session_id, message, on_token=None):
+        session = self.session(session_id)
+        if session.pending >= self.max_concurrent + self.max_pending:
+            raise SessionBusy(session_id)
+        session.pending += 1
+        try:
+            async with session.semaphore:
+                session.last_seen = time.monotonic()
+                return await session.dispatcher.handle(message, on_token=on_token)
+        finally:
+            session.pending -= 1
+            session.last_seen = time.monotonic()
+
+    async def _respond(self, request, writer):
+        session_id = request.get("session")
+        on_token = None
+        if request.get("stream"):
+            async def on_token(token):
+                writer.write((json.dumps({"token": token, "session": session_id}) + "\n").encode())
+                await writer.drain()
+        try:
+            turn = await self.handle(session_id, request["message"], on_token=on_token)
+            response = {"session": session_id, "intent": turn.intent, "reply": turn.reply,
+                        "time_to_first_token": turn.time_to_first_token}
+        except SessionBusy:
+            response = {"session": session_id, "error": "busy"}
+        except Exception as e:
+            response = {"session": session_id, "error": str(e)}
+        writer.write((json.dumps(response) + "\n").encode())
+        await writer.drain()
+
+    async def _client(self, reader, writer):
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                try:
+                    request = parse_request(line)
+                except ValueError as e:
+                    writer.write((json.dumps({"error": str(e)}) + "\n").encode())
+                    continue
+                task = asyncio.create_task(self._respond(request, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, metrics=None, metrics_port=None, path=None):
+        """Serve on host:port, or on the unix socket `path` when given."""
+        if path is not None:
+            server = await asyncio.start_unix_server(self._client, path)
+        else:
+            server = await asyncio.start_server(self._client, host, port)
+            print(f"serving on {host}:{port}")
+        if metrics is not None and metrics_port is not None:
+            await serve_metrics(metrics, host, metrics_port)
+        spiller = None
+        if self.spill is not None and self.idle_seconds is not None:
+            spiller = asyncio.create_task(self._spill_loop())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if spiller is not None:
+                spiller.cancel()
+
+
+async def serve_metrics(metrics, host, port):
+    """Answer every HTTP request on `port` with the Prometheus text exposition."""
+    async def respond(reader, writer):
+        # the request itself is irrelevant, read its head and reply
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        body = metrics.render().encode()
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     b"Content-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+        await writer.drain()
+        writer.close()
+
+    await asyncio.start_server(respond, host, port)
+    print(f"metrics on http://{host}:{port}/metrics")
+
+
+def build_server(flow_name, max_concurrent=1, instrumentation=None, idle_seconds=None, spill_path=None,
+                 speculate=False):
+    """SessionServer for the intent_and_functions.py ('functions') or intent.py ('intent') flow.
+
+    With `idle_seconds`, idle sessions are spilled to the SQLite file `spill_path`.
+    With `speculate`, branches start while the intent LLM runs (see speculation.py).
+    """
+    if flow_name == "functions":
+        import intent_and_functions as flow
+    else:
+        import intent as flow
+    llm = build_llm(streaming=True)
+    classifier = FastIntentClassifier()
+    spill = SpillStore(spill_path or ":memory:") if idle_seconds is not None else None
+    speculation = Speculation() if speculate else None
+    return SessionServer(lambda: flow.build_dispatcher(llm, classifier, instrumentation=instrumentation,
+                                                       speculation=speculation),
+                         max_concurrent=max_concurrent, spill=spill, idle_seconds=idle_seconds,
+                         metrics=instrumentation and instrumentation.metrics)
+
+
+def add_server_arguments(parser):
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--flow", choices=["functions", "intent"], default="functions",
+                        help="serve the intent_and_functions.py flow or the intent.py one")
+    parser.add_argument("--max-concurrent", type=int, default=1,
+                        help="messages processed at once per session")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics over HTTP on this port")
+    parser.add_argument("--trace", help="append one JSON line per turn to this file")
+    parser.add_argument("--idle-seconds", type=float,
+                        help="checkpoint sessions idle this long to disk and free their memory")
+    parser.add_argument("--spill", default="bookit-sessions.db", help="SQLite file for checkpointed sessions")
+    parser.add_argument("--speculate", action="store_true",
+                        help="start the likely branch while the intent LLM decides")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-session bookit conversation server")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    instrumentation = None
+    if args.metrics_port is not None or args.trace:
+        instrumentation = Instrumentation(trace_path=args.trace)
+    server = build_server(args.flow, args.max_concurrent, instrumentation, args.idle_seconds, args.spill,
+                          args.speculate)
+    asyncio.run(server.serve(args.host, args.port,
+                             metrics=instrumentation and instrumentation.metrics,
+                             metrics_port=args.metrics_port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import datetime
+import re
+
+# Local extraction of the booking details a guest has given so far
+# (party size, date and name), used to keep a compact summary of the
+# conversation instead of its full transcript and to call the booking tools
+# without going through the functions agent.
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+MONTHS = ['january', 'february', 'march', 'april', 'may', 'june', 'july',
+          'august', 'september', 'october', 'november', 'december']
+NUMBER_WORDS = {'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7,
+                'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12, 'couple': 2}
+
+_NUMBER = r"(\d{1,2}|" + "|".join(NUMBER_WORDS) + r")"
+_PARTY_PATTERNS = [
+    re.compile(r"\b(?:table|reservation|booking|room|space|seats?) for " + _NUMBER + r"\b"),
+    re.compile(r"\b" + _NUMBER + r" (?:people|persons|guests|adults|pax|of us)\b"),
+    re.compile(r"\bparty of " + _NUMBER + r"\b"),
+    re.compile(r"\bmake it(?: for)? " + _NUMBER + r"\b(?!\s*(?:am|pm|:|o'?clock|st|nd|rd|th)\b)"),
+    re.compile(r"\bwe(?: are|'re| will be| ll be|'ll be) " + _NUMBER + r"\b"),
+    # bare "for 4", but not times or dates ("for 8pm", "for the 4th")
+    re.compile(r"\bfor " + _NUMBER + r"\b(?!\s*(?:am|pm|:|o'?clock|st|nd|rd|th)\b)"),
+]
+# the prefix is matched in any case, the name itself must be capitalised
+_NAME_PREFIX = re.compile(r"\b(?i:my name is|name is|name's|under the name(?: of)?|under|it's for|it is for|"
+                          r"this is|i am|i'm) ([A-Z][a-zA-Z'-]+(?: [A-Z][a-zA-Z'-]+)?)")
+# a bare name, only trusted as the answer to "what name should I put it under?"
+# a reply that is, or starts with, a name: "Alice", "Alice Smith.", "Alice, on Saturday"
+_BARE_NAME = re.compile(r"^\s*([A-Z][a-zA-Z'-]+(?: [A-Z][a-zA-Z'-]+)?)\s*(?:[,.!]|$)")
+_NOT_NAMES = {'Hi', 'Hello', 'Hey', 'Yes', 'Yeah', 'Yep', 'Yup', 'No', 'Nope', 'Nah', 'Ok', 'Okay', 'Alright',
+              'Thanks', 'Thank', 'Cheers', 'Sure', 'Great', 'Perfect', 'Cool', 'Nice', 'Awesome', 'Good', 'Fine',
+              'Sounds', 'Right', 'Correct', 'Wait', 'Hold', 'Hmm', 'Sorry', 'Please', 'Maybe', 'Perhaps', 'Actually',
+              'Never', 'Bye', 'Here', 'Just', 'Not', 'Still', 'Also', 'Hungry', 'Back', 'Done', 'Well', 'Oh', 'So', 'Anyway',
+              'Tonight', 'Tomorrow', 'Today'} | {day.title() for day in WEEKDAYS} | {month.title() for month in MONTHS}
+_YES = re.compile(r"^\W*(yes|yeah|yep|yup|sure|correct|confirm(ed)?|ok(ay)?|alright|sounds good|perfect|great|"
+                  r"please do|go ahead|book it|that's right|that is right|right|exactly)\b")
+_NO = re.compile(r"^\W*(no|nope|nah|wrong|not quite|not right|wait|hold on|actually)\b")
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+_MONTH_DAY = re.compile(r"\b(" + "|".join(MONTHS) + r")\s+(\d{1,2})(?:st|nd|rd|th)?\b"
+                        r"|\b(\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?(" + "|".join(MONTHS) + r")\b")
+# 10/25, 25-10, 10/25/2026; not a time range ("7-8pm") or part of an ISO date
+_NUMERIC_DATE = re.compile(r"(?<![\d/-])(\d{1,2})[/-](\d{1,2})(?:[/-](\d{4}|\d{2}))?(?![\d/-])(?!\s*(?:am|pm)\b)")
+_DAY_OF_MONTH = re.compile(r"\b(?:the|on)\s+(\d{1,2})(?:st|nd|rd|th)?\b(?![/-]\d)|\b(\d{1,2})(?:st|nd|rd|th)\b")
+_WEEKDAY = re.compile(r"\b(this|next|coming)?\s*(" + "|".join(WEEKDAYS) + r")\b")
+_VAGUE_DATE = re.compile(r"\b(weekend|next week|this week|next month|sometime|some day|soon|"
+                         r"in (a|one|two|three|\d+) (days?|weeks?))\b")
+
+
+def _number(token):
+    return int(token) if token.isdigit() else NUMBER_WORDS[token]
+
+
+def _add_months(year, month, count):
+    month += count
+    return year + (month - 1) // 12, (month - 1) % 12 + 1
+
+
+def extract_party_size(text):
+    lowered = text.lower()
+    for pattern in _PARTY_PATTERNS:
+        match = pattern.search(lowered)
+        if match:
+            size = _number(match.group(1))
+            if 0 < size <= 50:
+                return size
+    return None
+
+
+def extract_name(text, expect_name=False):
+    """The name in "I'm Alex" / "under Alex", or a bare "Alex" if `expect_name` (the bot just asked for it)."""
+    patterns = (_NAME_PREFIX, _BARE_NAME) if expect_name else (_NAME_PREFIX,)
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match and not _NOT_NAMES.intersection(match.group(1).split()):
+            return match.group(1)
+    return None
+
+
+def confirmation(text):
+    """True if `text` confirms what the bot asked, False if it declines, None if it does neither."""
+    lowered = text.lower()
+    if _NO.search(lowered):
+        return False
+    if _YES.search(lowered):
+        return True
+    return None
+
+
+def _numeric_dates(match, today):
+    """Every date `match` of _NUMERIC_DATE can mean, as month/day or day/month."""
+    first, second, year = int(match.group(1)), int(match.group(2)), match.group(3)
+    dates = set()
+    for month, day in ((first, second), (second, first)):
+        years = [int(year) + (2000 if len(year) == 2 else 0)] if year else [today.year, today.year + 1]
+        for y in years:
+            try:
+                date = datetime.date(y, month, day)
+            except ValueError:
+                continue
+            if year or date >= today:
+                dates.add(date)
+                break
+    return dates
+
+
+def extract_date(text, today=None):
+    """Resolve the first date mentioned in `text` against `today`."""
+    today = today or datetime.date.today()
+    lowered = text.lower()
+
+    match = _ISO_DATE.search(lowered)
+    if match:
+        try:
+            return datetime.date(*map(int, match.groups()))
+        except ValueError:
+            pass
+    match = _NUMERIC_DATE.search(lowered)
+    if match:
+        dates = _numeric_dates(match, today)
+        # 5/6 could be May 6 or June 5: left to is_ambiguous
+        return dates.pop() if len(dates) == 1 else None
+    if re.search(r"\b(today|tonight|this evening)\b", lowered):
+        return today
+    if re.search(r"\bday after tomorrow\b", lowered):
+        return today + datetime.timedelta(days=2)
+    if re.search(r"\btomorrow\b", lowered):
+        return today + datetime.timedelta(days=1)
+
+    match = _MONTH_DAY.search(lowered)
+    if match:
+        month_name = match.group(1) or match.group(4)
+        day = int(match.group(2) or match.group(3))
+        month = MONTHS.index(month_name) + 1
+        for year in (today.year, today.year + 1):
+            try:
+                date = datetime.date(year, month, day)
+            except ValueError:
+                return None
+            if date >= today:
+                return date
+        return None
+
+    match = _WEEKDAY.search(lowered)
+    if match:
+        ahead = (WEEKDAYS.index(match.group(2)) - today.weekday()) % 7
+        if match.group(1) == 'next' and ahead == 0:
+            ahead = 7
+        return today + datetime.timedelta(days=ahead)
+
+    match = _DAY_OF_MONTH.search(lowered)
+    if match:
+        day = int(match.group(1) or match.group(2))
+        if not 1 <= day <= 31:
+            return None
+        year, month = today.year, today.month
+        if day < today.day:
+            year, month = _add_months(year, month, 1)
+        for _ in range(12):
+            try:
+                return datetime.date(year, month, day)
+            except ValueError:
+                year, month = _add_months(year, month, 1)
+    return None
+
+
+def ambiguous_slots(text, today=None):
+    """The slots ('date', 'seats') `text` mentions in a way the local extractor cannot pin down.
+
+    Catches vague dates ("next weekend", "in two weeks"), alternatives ("friday
+    or saturday", "the 12th or 13th"), numeric dates that read both ways
+    ("5/6", "10/40") and several competing party sizes.
+    """
+    today = today or datetime.date.today()
+    lowered = text.lower()
+    slots = set()
+    if (_VAGUE_DATE.search(lowered)
+            or len({m.group(2) for m in _WEEKDAY.finditer(lowered)}) > 1
+            or len(_MONTH_DAY.findall(lowered)) > 1
+            or len({m.group(1) or m.group(2) for m in _DAY_OF_MONTH.finditer(lowered)}) > 1
+            or any(len(_numeric_dates(m, today)) != 1 for m in _NUMERIC_DATE.finditer(lowered))):
+        slots.add('date')
+    sizes = {_number(m.group(1)) for pattern in _PARTY_PATTERNS for m in pattern.finditer(lowered)}
+    if len(sizes) > 1:
+        slots.add('seats')
+    return slots
+
+
+def is_ambiguous(text, today=None):
+    """True if `text` mentions dates or numbers the local extractor cannot pin down, see ambiguous_slots."""
+    return bool(ambiguous_slots(text, today))
+
+
+def extract_slots(text, today=None, expect_name=False):
+    """Return the slots found in `text` as a dict with any of 'seats', 'date', 'name'."""
+    slots = {}
+    seats = extract_party_size(text)
+    if seats is not None:
+        slots['seats'] = seats
+    date = extract_date(text, today)
+    if date is not None:
+        slots['date'] = date
+    name = extract_name(text, expect_name)
+    if name is not None:
+        slots['name'] = name
+    return slots
+
+
+def describe_slots(slots):
+    """One-line summary of the known slots, or '' if none are known."""
+    parts = []
+    if 'seats' in slots:
+        parts.append(f"party size {slots['seats']}")
+    if 'date' in slots:
+        parts.append(f"date {slots['date'].isoformat()}")
+    if 'name' in slots:
+        parts.append(f"name {slots['name']}")
+    return "Details given so far: " + ", ".join(parts) if parts else ""
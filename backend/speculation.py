@@ -0,0 +1,157 @@
+import asyncio
+import contextvars
+import threading
+from typing import Optional
+
+from langchain_core.callbacks.base import AsyncCallbackHandler
+
+from checkpoint import restore_session, session_state
+from memory import approx_token_count
+
+# Speculative branch execution: when a fresh message has to wait for the
+# intent LLM, the branch the local classifier guesses is started at the same
+# time. Its reply is kept if the LLM agrees; otherwise it is cancelled and
+# the session's memories, slots and branch state are put back as they were.
+
+_gate = contextvars.ContextVar("speculation_gate", default=None)
+
+
+async def commit_point():
+    """Call before any side effect (e.g. booking) a branch performs.
+
+    Outside a speculative run this returns at once; inside one it waits until
+    the intent is confirmed (on a miss the run is cancelled while waiting).
+    """
+    gate = _gate.get()
+    if gate is not None:
+        await gate
+
+
+class Speculation:
+    """Settings and counters of speculative execution, shared by the dispatchers using it.
+
+    A branch is started early when the local classifier's guess is at least
+    `min_confidence` sure (but below its own threshold, else the LLM is not
+    asked at all).
+    """
+
+    def __init__(self, min_confidence=0.3):
+        self.min_confidence = min_confidence
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+        self.wasted_prompt_tokens = 0
+        self.wasted_completion_tokens = 0
+
+    def record(self, hit, tally=None):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.wasted_prompt_tokens += tally.prompt_tokens
+                self.wasted_completion_tokens += tally.completion_tokens
+
+    def stats(self):
+        runs = self.hits + self.misses
+        return {'speculations': runs, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / runs, 4) if runs else 0.0,
+                'wasted_prompt_tokens': self.wasted_prompt_tokens,
+                'wasted_completion_tokens': self.wasted_completion_tokens}
+
+
+class TokenTally(AsyncCallbackHandler):
+    """Counts (or estimates) the tokens a run sent and received, even if it is cancelled midway."""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._streamed = set()
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs) -> None:
+        self.prompt_tokens += sum(approx_token_count(str(m.content)) for batch in messages for m in batch)
+
+    async def on_llm_start(self, serialized, prompts, *, run_id, **kwargs) -> None:
+        self.prompt_tokens += sum(approx_token_count(p) for p in prompts)
+
+    async def on_llm_new_token(self, token, *, run_id, **kwargs) -> None:
+        self._streamed.add(run_id)
+        self.completion_tokens += 1
+
+    async def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        if run_id not in self._streamed:
+            text = " ".join(g.text for batch in response.generations for g in batch)
+            self.completion_tokens += approx_token_count(text)
+
+
+class GatedStream(AsyncCallbackHandler):
+    """Holds a speculative run's tokens back until `release()`, then forwards them to `stream`."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.released = False
+        self._buffer = []
+
+    async def on_llm_new_token(self, token, **kwargs) -> None:
+        if self.released:
+            await self.stream.on_llm_new_token(token)
+        else:
+            self._buffer.append(token)
+
+    async def release(self):
+        # tokens arriving while the buffer drains are appended and drained too
+        while self._buffer:
+            await self.stream.on_llm_new_token(self._buffer.pop(0))
+        self.released = True
+
+
+class SpeculativeRun:
+    """A branch started before its intent is known; see SessionDispatcher.handle."""
+
+    def __init__(self, dispatcher, intent, query, trace=None, stream=None):
+        self.dispatcher = dispatcher
+        self.intent = intent
+        # taken before the branch can touch anything
+        self.state = session_state(dispatcher)
+        self.tally = TokenTally()
+        self.gated = GatedStream(stream) if stream is not None else None
+        self.gate = asyncio.get_running_loop().create_future()
+        callbacks = [handler for handler in (trace, self.gated, self.tally) if handler is not None]
+        self.task = asyncio.create_task(self._run(dispatcher.branches[intent], query, callbacks))
+
+    async def _run(self, branch, query, callbacks):
+        _gate.set(self.gate)
+        return await branch(query, callbacks=callbacks)
+
+    async def confirm(self) -> str:
+        self.gate.set_result(True)
+        if self.gated is not None:
+            await self.gated.release()
+        return await self.task
+
+    async def discard(self, intent_memory=None):
+        """Cancel the run and undo what it changed, except the intent history."""
+        self.task.cancel()
+        await asyncio.wait([self.task])
+        if not self.task.cancelled():
+            # finished (or failed) before the intent came back; the result is dropped
+            self.task.exception()
+        self.state["intent"] = self.dispatcher.intent
+        if intent_memory is not None:
+            self.state["memories"].pop(intent_memory.memory_key, None)
+        restore_session(self.dispatcher, self.state)
+
+
+def speculation_guess(classifier, query, speculation, branches) -> Optional[str]:
+    """The branch worth starting early for `query`, or None."""
+    if classifier is None or speculation is None:
+        return None
+    guess = classifier.predict(query)
+    if guess is None or guess.intent not in branches:
+        return None
+    if not speculation.min_confidence <= guess.confidence < classifier.threshold:
+        return None
+    return guess.intent
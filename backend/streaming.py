@@ -0,0 +1,48 @@
+import asyncio
+import inspect
+import time
+from typing import Optional
+
+from langchain_core.callbacks.base import AsyncCallbackHandler
+
+_DONE = object()
+
+
+class TokenStream(AsyncCallbackHandler):
+    """Callback handler that forwards a turn's completion tokens as they arrive.
+
+    Pass it in `callbacks=[...]` of a chain or agent run on an LLM built with
+    `streaming=True`. Tokens go to `on_token` (sync or async) and can also be
+    consumed with `async for`; the iteration ends once `close()` is called.
+    Function-call chunks carry no text, so an agent only streams its final answer.
+    """
+
+    def __init__(self, on_token=None):
+        self.on_token = on_token
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self._queue = asyncio.Queue()
+
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        if not token:
+            return
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        if self.on_token is not None:
+            result = self.on_token(token)
+            if inspect.isawaitable(result):
+                await result
+        self._queue.put_nowait(token)
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    def close(self):
+        self._queue.put_nowait(_DONE)
+
+    async def __aiter__(self):
+        while (token := await self._queue.get()) is not _DONE:
+            yield token
@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import zlib
+from collections import Counter
+
+from instrumentation import Instrumentation
+from server import TOKEN_PREFIX, add_server_arguments, build_server, parse_request
+
+# Multi-process mode: a supervisor accepts the same newline-delimited JSON
+# protocol as server.py and forwards every message to one of N worker
+# processes, always the same one for a given session id, so the session's
+# chains and memories stay in that worker. Workers share reservations through
+# the SQLite store (BOOKIT_DB) and are restarted if they die.
+
+
+def worker_for(session_id, workers):
+    # stable across processes and restarts, unlike hash()
+    return zlib.crc32(str(session_id).encode()) % workers
+
+
+def run_worker(path, flow_name, max_concurrent, metrics_port, trace, idle_seconds=None, spill=None,
+               speculate=False):
+    instrumentation = None
+    if metrics_port is not None or trace:
+        instrumentation = Instrumentation(trace_path=trace)
+    server = build_server(flow_name, max_concurrent, instrumentation, idle_seconds, spill, speculate)
+    asyncio.run(server.serve(path=path, metrics=instrumentation and instrumentation.metrics,
+                             metrics_port=metrics_port))
+
+
+class Supervisor:
+    """Starts, routes to and restarts a fixed set of worker processes.
+
+    Worker i listens on a unix socket; its metrics, if enabled, are served
+    on `metrics_port + i`, its trace goes to `<trace>.<i>` and its spilled
+    sessions to `<spill>.<i>`.
+    """
+
+    def __init__(self, workers, flow_name="functions", max_concurrent=1, metrics_port=None, trace=None,
+                 idle_seconds=None, spill=None, speculate=False):
+        self.flow_name = flow_name
+        self.max_concurrent = max_concurrent
+        self.metrics_port = metrics_port
+        self.trace = trace
+        self.idle_seconds = idle_seconds
+        self.spill = spill
+        self.speculate = speculate
+        self.socket_dir = tempfile.mkdtemp(prefix="bookit-")
+        self.paths = [os.path.join(self.socket_dir, f"worker-{i}.sock") for i in range(workers)]
+        self.processes = [None] * workers
+        methods = multiprocessing.get_all_start_methods()
+        # forkserver forks from a clean process that has langchain preloaded:
+        # cheap restarts, and no event loop state inherited from the supervisor
+        self._context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        if "forkserver" in methods:
+            # the chains import langchain lazily; import it once in the fork
+            # server instead, so every worker (and every restart) starts warm
+            self._context.set_forkserver_preload(["server", "llm_client", "langchain.chains",
+                                                  "langchain.prompts", "langchain.agents"])
+
+    def start_worker(self, index):
+        path = self.paths[index]
+        if os.path.exists(path):
+            os.unlink(path)
+        process = self._context.Process(
+            target=run_worker, name=f"bookit-worker-{index}", daemon=True,
+            args=(path, self.flow_name, self.max_concurrent,
+                  self.metrics_port + index if self.metrics_port is not None else None,
+                  f"{self.trace}.{index}" if self.trace else None,
+                  self.idle_seconds, f"{self.spill}.{index}" if self.spill else None, self.speculate))
+        process.start()
+        self.processes[index] = process
+
+    def start(self, timeout=60):
+        for index in range(len(self.paths)):
+            self.start_worker(index)
+        deadline = time.monotonic() + timeout
+        while not all(os.path.exists(path) for path in self.paths):
+            if time.monotonic() > deadline:
+                raise RuntimeError("workers did not start in time")
+            time.sleep(0.05)
+
+    def stop(self):
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                process.join(5)
+        shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+    async def monitor(self, interval=0.5):
+        while True:
+            await asyncio.sleep(interval)
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    print(f"worker {index} exited with code {process.exitcode}, restarting")
+                    self.start_worker(index)
+
+    async def _client(self, reader, writer):
+        # one upstream connection per worker this client talks to
+        upstreams = {}
+        relays = set()
+
+        def send(response):
+            writer.write((json.dumps(response) + "\n").encode())
+
+        async def relay(index, upstream_reader, in_flight):
+            try:
+                while line := await upstream_reader.readline():
+                    # only the final line of a reply is parsed, streamed tokens are passed through
+                    if not line.startswith(TOKEN_PREFIX):
+                        session_id = json.loads(line).get("session")
+                        if in_flight[session_id] > 0:
+                            in_flight[session_id] -= 1
+                    writer.write(line)
+                    await writer.drain()
+            except (ConnectionError, json.JSONDecodeError):
+                pass
+            finally:
+                upstreams.pop(index, None)
+                # only the sessions of a crashed worker see an error
+                for session_id, count in in_flight.items():
+                    for _ in range(count):
+                        send({"session": session_id, "error": "worker restarted"})
+
+        async def upstream(index):
+            if index not in upstreams:
+                upstream_reader, upstream_writer = await asyncio.open_unix_connection(self.paths[index])
+                in_flight = Counter()
+                upstreams[index] = (upstream_writer, in_flight)
+                task = asyncio.create_task(relay(index, upstream_reader, in_flight))
+                relays.add(task)
+                task.add_done_callback(relays.discard)
+            return upstreams[index]
+
+        try:
+            while line := await reader.readline():
+                try:
+                    session_id = parse_request(line).get("session")
+                except ValueError as e:
+                    send({"error": str(e)})
+                    continue
+                try:
+                    upstream_writer, in_flight = await upstream(worker_for(session_id, len(self.paths)))
+                except OSError:
+                    send({"session": session_id, "error": "worker unavailable"})
+                    continue
+                # counted before writing so a fast reply cannot arrive first
+                in_flight[session_id] += 1
+                upstream_writer.write(line if line.endswith(b"\n") else line + b"\n")
+                await upstream_writer.drain()
+            for upstream_writer, _ in list(upstreams.values()):
+                upstream_writer.write_eof()
+            if relays:
+                await asyncio.wait(relays)
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        server = await asyncio.start_server(self._client, host, port)
+        print(f"supervising {len(self.paths)} workers on {host}:{port}")
+        monitor = asyncio.create_task(self.monitor())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            monitor.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bookit server as N worker processes")
+    add_server_arguments(parser)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--db", default=os.environ.get("BOOKIT_DB", "bookit.db"),
+                        help="SQLite reservation database shared by the workers")
+    args = parser.parse_args()
+
+    os.environ["BOOKIT_DB"] = os.path.abspath(args.db)
+    supervisor = Supervisor(args.workers, args.flow, args.max_concurrent, args.metrics_port, args.trace,
+                            args.idle_seconds, args.spill, args.speculate)
+    supervisor.start()
+    try:
+        asyncio.run(supervisor.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import datetime
+import random
+
+import pytest
+
+from capacity import CapacityCalendar
+
+START = datetime.date(2026, 1, 1)
+
+
+def day(offset):
+    return START + datetime.timedelta(days=offset)
+
+
+def brute_force_nearest(calendar, date, seats, k, earliest):
+    candidates = [day(i) for i in range(calendar.days)
+                  if day(i) >= earliest and calendar.free(day(i)) >= seats]
+    target = min(max(date, earliest, START), day(calendar.days - 1))
+    # nearest first, ties to the later date
+    return sorted(candidates, key=lambda d: (abs((d - target).days), d < target))[:k]
+
+
+def test_nearest_prefers_the_target_then_alternates_ties_to_the_later_date():
+    calendar = CapacityCalendar(10, start=START, horizon_days=30)
+    for offset in (9, 10, 11):
+        calendar.set_free(day(offset), 0)
+    assert calendar.nearest(day(20), 2, k=1, earliest=START) == [day(20)]
+    assert calendar.nearest(day(10), 2, k=4, earliest=START) == [day(12), day(8), day(13), day(7)]
+
+
+def test_nearest_respects_seats_earliest_and_the_horizon():
+    calendar = CapacityCalendar(10, start=START, horizon_days=30)
+    calendar.set_free(day(5), 3)
+    assert day(5) in calendar.nearest(day(5), 3, k=1, earliest=START)
+    assert day(5) not in calendar.nearest(day(5), 4, k=3, earliest=START)
+    # nothing before `earliest`, even when it is closer
+    assert calendar.nearest(day(3), 1, k=3, earliest=day(4)) == [day(4), day(5), day(6)]
+    # targets past the horizon search back from its last day
+    assert calendar.nearest(day(100), 1, k=2, earliest=START) == [day(29), day(28)]
+    assert calendar.nearest(day(0), 11, k=3, earliest=START) == []
+    assert len(calendar.nearest(day(0), 1, k=50, earliest=START)) == 30
+
+
+def test_dates_outside_the_horizon_are_ignored():
+    calendar = CapacityCalendar(10, start=START, horizon_days=30)
+    calendar.set_free(day(-1), 0)
+    calendar.set_free(day(30), 0)
+    assert calendar.free(day(-1)) is None and calendar.free(day(30)) is None
+    assert calendar.nearest(day(40), 1, k=1, earliest=START) == [day(29)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_nearest_matches_a_linear_scan(seed):
+    rng = random.Random(seed)
+    # a horizon that is not a power of two leaves padding leaves in the tree
+    calendar = CapacityCalendar(8, start=START, horizon_days=100)
+    for _ in range(300):
+        calendar.set_free(day(rng.randrange(100)), rng.randint(0, 8))
+    for _ in range(200):
+        date = day(rng.randrange(-10, 110))
+        seats = rng.randint(1, 8)
+        k = rng.randint(1, 6)
+        earliest = day(rng.randrange(0, 50))
+        assert calendar.nearest(date, seats, k, earliest) == brute_force_nearest(calendar, date, seats, k, earliest)
@@ -0,0 +1,98 @@
+import asyncio
+import datetime
+
+import pytest
+
+import intent_and_functions as flow
+from benchmark import SCRIPTS
+from cache import intent_cache, qa_cache
+from checkpoint import SpillStore, decode_state, encode_state, restore_session, session_state
+from fake_llm import FakeChatModel
+from fast_intent import FastIntentClassifier
+from reservations import ReservationStore
+from server import SessionServer
+from speculation import Speculation
+
+TODAY = datetime.date(2026, 10, 18)
+FRIDAY = datetime.date(2026, 10, 23)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = ReservationStore(capacity=15)
+    monkeypatch.setattr(flow, "reservations", store)
+    intent_cache.clear()
+    qa_cache.clear()
+    return store
+
+
+def dispatcher(**kwargs):
+    return flow.build_dispatcher(FakeChatModel(latency=0), FastIntentClassifier(), current_date=TODAY, **kwargs)
+
+
+def test_speculation_miss_leaves_the_branch_as_it_was(store):
+    store.book(FRIDAY, 4, "Alice")
+    speculation = Speculation()
+    session = dispatcher(speculation=speculation)
+
+    async def run():
+        # the classifier half-guesses Cancel and starts it; the intent LLM says Unclear
+        missed = await session.handle("we won't make it, under Alice on Friday")
+        asked = await session.handle("cancel my booking please")
+        return missed, asked
+
+    missed, asked = asyncio.run(run())
+    assert speculation.misses == 1
+    assert missed.intent == 'Unclear'
+    assert asked.intent == 'Cancel'
+    cancel = session.branches['Cancel']
+    assert cancel.seats is None and cancel.changes == {} and cancel.asked == 'name'
+    assert store.find("Alice", FRIDAY).seats == 4
+
+
+def test_branch_state_survives_a_round_trip(store):
+    store.book(FRIDAY, 4, "Alice")
+    session = dispatcher()
+
+    async def run():
+        for message in ["I need to change my reservation", "It's under Alice for Friday", "make it 6 people"]:
+            await session.handle(message)
+
+    asyncio.run(run())
+    edit = session.branches['Edit']
+    restored = dispatcher()
+    restore_session(restored, decode_state(encode_state(session_state(session))))
+    copy = restored.branches['Edit']
+    assert (copy.slots, copy.seats, copy.changes, copy.asked) == (edit.slots, edit.seats, edit.changes, edit.asked)
+    assert copy.asked == ("Alice", FRIDAY, FRIDAY, 6)
+
+
+def run_scripts(monkeypatch, spill):
+    """Run every benchmark script in turn, spilling each session between its turns if `spill`."""
+    store = ReservationStore(capacity=15)
+    monkeypatch.setattr(flow, "reservations", store)
+    intent_cache.clear()
+    qa_cache.clear()
+    server = SessionServer(dispatcher, spill=SpillStore() if spill else None)
+    scripts = dict(SCRIPTS, confirmed_edit=["I need to change my reservation", "It's under Alice for Friday",
+                                            "Can you move it to Saturday?", "Yes"])
+
+    async def run():
+        turns = []
+        for session_id, script in scripts.items():
+            for message in script:
+                turn = await server.handle(session_id, message)
+                turns.append((session_id, turn.intent, turn.reply))
+                if spill:
+                    assert server.spill_session(session_id)
+        return turns
+
+    turns = asyncio.run(run())
+    return turns, dict(store._reservations)
+
+
+def test_spilling_between_turns_changes_nothing(monkeypatch):
+    turns, bookings = run_scripts(monkeypatch, spill=True)
+    assert (turns, bookings) == run_scripts(monkeypatch, spill=False)
+    # booked, then moved by the confirmed edit
+    assert [(r.name, r.date, r.seats) for r in bookings.values()] == [("Alice", FRIDAY + datetime.timedelta(days=1), 4)]
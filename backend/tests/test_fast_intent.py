@@ -0,0 +1,40 @@
+import pytest
+
+from fast_intent import TRAINING_EXAMPLES, FastIntentClassifier
+from routing import TopicSwitchDetector
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return FastIntentClassifier()
+
+
+@pytest.mark.parametrize("message", ["please help", "Yes please", "yes", "Thanks!", "Hi there", "ok great",
+                                     "Friday", "Alice"])
+def test_messages_without_content_are_left_to_the_llm(classifier, message):
+    assert classifier.predict(message) is None
+    assert classifier.classify(message) is None
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("table for 4 on friday", "New"),
+    ("Hi, I'd like to book a table for 4 on Friday", "New"),
+    ("can we move our booking to saturday", "Edit"),
+    ("we cannot come anymore", "Cancel"),
+    ("Please cancel my booking", "Cancel"),
+    ("what time do you open", "QA"),
+])
+def test_clear_messages_are_classified_locally(classifier, message, intent):
+    assert classifier.classify(message).intent == intent
+
+
+def test_training_examples_are_classified_locally(classifier):
+    assert all(getattr(classifier.classify(text), "intent", None) == label for text, label in TRAINING_EXAMPLES)
+
+
+@pytest.mark.parametrize("branch", ["New", "Edit"])
+def test_confirmations_do_not_look_like_a_topic_switch(classifier, branch):
+    detector = TopicSwitchDetector(classifier)
+    assert not detector("Yes please", branch)
+    assert not detector("Alice", branch)
+    assert detector("actually, cancel it", branch)
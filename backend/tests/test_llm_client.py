@@ -0,0 +1,223 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from langchain.schema import HumanMessage
+
+import mock_openai
+from llm_client import ClientLimits, PooledChatOpenAI, TokenBucket, is_retryable, retry_after
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class APIConnectionError(Exception):
+    pass
+
+
+def test_retryable_errors():
+    assert is_retryable(StatusError(429)) and is_retryable(StatusError(503))
+    assert not is_retryable(StatusError(400)) and not is_retryable(StatusError(401))
+    assert is_retryable(APIConnectionError())
+    assert not is_retryable(ValueError())
+    assert retry_after(StatusError(429, {"retry-after": "1.5"})) == 1.5
+    assert retry_after(StatusError(429)) is None
+
+
+def test_token_bucket_serves_a_burst_then_spaces_requests():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert [bucket.reserve() for _ in range(2)] == [0.0, 0.0]
+    waits = [bucket.reserve() for _ in range(2)]
+    assert 0.09 < waits[0] < waits[1] <= 0.2
+
+
+def flaky(failures, error):
+    calls = []
+
+    async def call():
+        calls.append(time.monotonic())
+        if len(calls) <= failures:
+            raise error
+        return "ok"
+    return call, calls
+
+
+def test_transient_errors_are_retried_up_to_max_retries():
+    limits = ClientLimits(max_retries=3, base_delay=0.001)
+    call, calls = flaky(3, StatusError(429))
+    assert asyncio.run(limits.acall(call)) == "ok"
+    assert len(calls) == 4 and limits.retries == 3
+
+    call, calls = flaky(4, StatusError(429))
+    with pytest.raises(StatusError):
+        asyncio.run(limits.acall(call))
+    assert len(calls) == 4
+
+
+def test_other_errors_are_not_retried():
+    limits = ClientLimits(max_retries=3, base_delay=0.001)
+    call, calls = flaky(1, StatusError(400))
+    with pytest.raises(StatusError):
+        asyncio.run(limits.acall(call))
+    assert len(calls) == 1 and limits.retries == 0
+
+
+def test_retry_waits_for_retry_after():
+    limits = ClientLimits(max_retries=1, base_delay=10)
+    call, calls = flaky(1, StatusError(503, {"retry-after": "0.05"}))
+    assert asyncio.run(limits.acall(call)) == "ok"
+    assert 0.05 <= calls[1] - calls[0] < 1
+
+
+def test_calls_are_capped_at_max_in_flight():
+    limits = ClientLimits(max_in_flight=3)
+
+    async def call():
+        await asyncio.sleep(0.01)
+        return limits.in_flight
+
+    async def run():
+        return await asyncio.gather(*(limits.acall(call) for _ in range(12)))
+
+    assert max(asyncio.run(run())) == 3
+    assert limits.stats()["max_in_flight"] == 3 and limits.in_flight == 0
+
+
+def test_blocking_calls_retry_too():
+    limits = ClientLimits(max_retries=2, base_delay=0.001)
+    attempts = []
+
+    def call():
+        attempts.append(threading.get_ident())
+        if len(attempts) < 3:
+            raise APIConnectionError()
+        return "ok"
+
+    assert limits.call(call) == "ok"
+    assert len(attempts) == 3
+
+
+# PooledChatOpenAI against mock_openai.py
+
+@pytest.fixture
+def mock_api():
+    servers = []
+
+    def start(latency=0.2, rate_limit_every=0):
+        server, stats = mock_openai.serve(port=0, latency=latency, rate_limit_every=rate_limit_every)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/v1", stats
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def chat_model(url, **kwargs):
+    limits = ClientLimits(max_retries=kwargs.pop("max_retries", 4), base_delay=0.01)
+    params = dict(model_name="gpt-3.5-turbo", temperature=0, openai_api_key="test", openai_api_base=url,
+                  max_retries=0, limits=limits)
+    return PooledChatOpenAI(**{**params, **kwargs})
+
+
+def ask(llm, question):
+    return llm.agenerate([[HumanMessage(content=question)]])
+
+
+def text(result):
+    return result.generations[0][0].text
+
+
+def test_identical_concurrent_requests_share_one_call(mock_api):
+    url, stats = mock_api()
+    llm = chat_model(url)
+
+    async def run():
+        return await asyncio.gather(*(ask(llm, "What time do you open?") for _ in range(8)),
+                                    ask(llm, "Do you have vegan options?"))
+
+    results = asyncio.run(run())
+    assert {text(result) for result in results} == {"We are open every evening from 6pm to 11pm."}
+    assert stats.requests == 2
+    assert llm.limits.coalesced == 7
+    assert llm.limits.pending == {}
+
+
+def test_no_coalescing_above_temperature_zero(mock_api):
+    url, stats = mock_api(latency=0.05)
+    llm = chat_model(url, temperature=0.7)
+
+    async def run():
+        return await asyncio.gather(*(ask(llm, "What time do you open?") for _ in range(3)))
+
+    asyncio.run(run())
+    assert stats.requests == 3 and llm.limits.coalesced == 0
+
+
+def test_rate_limited_requests_are_retried(mock_api):
+    url, stats = mock_api(latency=0.01, rate_limit_every=3)
+    llm = chat_model(url)
+
+    async def run():
+        return await asyncio.gather(*(ask(llm, f"question {i}") for i in range(6)))
+
+    results = asyncio.run(run())
+    assert len(results) == 6
+    assert stats.rate_limited >= 2 and llm.limits.retries == stats.rate_limited
+
+
+def test_followers_share_the_leaders_error(mock_api):
+    url, stats = mock_api(latency=0.1, rate_limit_every=1)
+    llm = chat_model(url, max_retries=0)
+
+    async def run():
+        return await asyncio.gather(*(ask(llm, "What time do you open?") for _ in range(3)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(type(result).__name__ == "RateLimitError" for result in results)
+    assert stats.requests == 1
+
+
+def test_followers_call_again_when_the_leader_is_cancelled(mock_api):
+    url, stats = mock_api()
+    llm = chat_model(url)
+
+    async def run():
+        leader = asyncio.create_task(ask(llm, "What time do you open?"))
+        await asyncio.sleep(0.05)
+        followers = [asyncio.create_task(ask(llm, "What time do you open?")) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        results = await asyncio.gather(*followers)
+        return leader, results
+
+    leader, results = asyncio.run(run())
+    assert leader.cancelled()
+    assert all(text(result) for result in results)
+    # the cancelled call, then one new call led by the first follower
+    assert stats.requests == 2
+
+
+def test_cancelling_a_follower_leaves_the_leader_alone(mock_api):
+    url, stats = mock_api()
+    llm = chat_model(url)
+
+    async def run():
+        leader = asyncio.create_task(ask(llm, "What time do you open?"))
+        await asyncio.sleep(0.05)
+        follower = asyncio.create_task(ask(llm, "What time do you open?"))
+        await asyncio.sleep(0.05)
+        follower.cancel()
+        result = await leader
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        return result
+
+    assert text(asyncio.run(run()))
+    assert stats.requests == 1
@@ -0,0 +1,139 @@
+import datetime
+import random
+import sys
+import threading
+import time
+
+import pytest
+
+from reservations import ReservationStore, to_date
+
+FRIDAY = datetime.date.today() + datetime.timedelta(days=7)
+SATURDAY = FRIDAY + datetime.timedelta(days=1)
+
+
+def booked(store, date):
+    return store.capacity - store.available(date)
+
+
+def test_edit_moves_the_reservation_and_its_seats():
+    store = ReservationStore(capacity=10)
+    store.book(FRIDAY, 4, "Alice")
+    updated = store.edit("alice", FRIDAY, new_date=SATURDAY)
+    assert (updated.name, updated.date, updated.seats) == ("Alice", SATURDAY, 4)
+    assert store.find("Alice", FRIDAY) is None
+    assert store.find("Alice", SATURDAY) == updated
+    assert (booked(store, FRIDAY), booked(store, SATURDAY)) == (0, 4)
+    assert store.calendar.free(FRIDAY) == 10 and store.calendar.free(SATURDAY) == 6
+
+
+def test_edit_on_the_same_date_counts_the_seats_it_frees():
+    store = ReservationStore(capacity=10)
+    store.book(FRIDAY, 6, "Alice")
+    store.book(FRIDAY, 2, "Bob")
+    assert store.edit("Alice", FRIDAY, seats=8).seats == 8
+    assert booked(store, FRIDAY) == 10
+    assert store.edit("Alice", FRIDAY, seats=9) is None
+    assert store.find("Alice", FRIDAY).seats == 8
+
+
+def test_refused_edit_leaves_the_booking_untouched():
+    store = ReservationStore(capacity=10)
+    store.book(FRIDAY, 4, "Alice")
+    store.book(SATURDAY, 8, "Bob")
+    assert store.edit("Alice", FRIDAY, new_date=SATURDAY) is None
+    assert store.find("Alice", FRIDAY).seats == 4
+    assert (booked(store, FRIDAY), booked(store, SATURDAY)) == (4, 8)
+
+
+def test_edit_refuses_to_overwrite_a_booking_on_the_new_date():
+    store = ReservationStore(capacity=10)
+    store.book(FRIDAY, 2, "Alice")
+    store.book(SATURDAY, 3, "Alice")
+    assert store.edit("Alice", FRIDAY, new_date=SATURDAY) is None
+    assert (booked(store, FRIDAY), booked(store, SATURDAY)) == (2, 3)
+
+
+def test_edit_of_a_missing_reservation_and_bad_seats():
+    store = ReservationStore(capacity=10)
+    assert store.edit("Nobody", FRIDAY, new_date=SATURDAY) is None
+    store.book(FRIDAY, 2, "Alice")
+    with pytest.raises(ValueError):
+        store.edit("Alice", FRIDAY, seats=0)
+
+
+@pytest.fixture
+def fast_switching():
+    # switch threads often, so they interleave inside the store's critical sections
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_crossing_edits_do_not_deadlock_or_overbook(fast_switching):
+    # half the guests move Friday -> Saturday while the other half move
+    # Saturday -> Friday, so edits need the same two date locks from both sides
+    store = ReservationStore(capacity=40)
+    names = [f"guest{i}" for i in range(20)]
+    for i, name in enumerate(names):
+        store.book(FRIDAY if i % 2 else SATURDAY, 2, name)
+    dates = {name: FRIDAY if i % 2 else SATURDAY for i, name in enumerate(names)}
+    errors = []
+
+    def move(name, rounds):
+        rng = random.Random(name)
+        try:
+            for _ in range(rounds):
+                date = dates[name]
+                target = SATURDAY if date == FRIDAY else FRIDAY
+                if store.edit(name, date, new_date=target, seats=rng.randint(1, 3)) is not None:
+                    dates[name] = target
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=move, args=(name, 200), daemon=True) for name in names]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 10
+    for thread in threads:
+        thread.join(timeout=max(0, deadline - time.monotonic()))
+    assert not any(thread.is_alive() for thread in threads), "edits deadlocked"
+    assert not errors
+    for date in (FRIDAY, SATURDAY):
+        seats = sum(store.find(name, date).seats for name in names if dates[name] == date)
+        assert booked(store, date) == seats <= store.capacity
+        assert store.calendar.free(date) == store.capacity - seats
+
+
+def test_concurrent_edits_into_a_full_date_never_overbook(fast_switching):
+    store = ReservationStore(capacity=30)
+    names = [f"guest{i}" for i in range(10)]
+    for name in names:
+        store.book(FRIDAY, 3, name)
+    store.book(SATURDAY, 21, "Party")
+    start = threading.Barrier(len(names))
+    results = {}
+
+    def move(name):
+        start.wait()
+        results[name] = store.edit(name, FRIDAY, new_date=SATURDAY)
+
+    threads = [threading.Thread(target=move, args=(name,)) for name in names]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    moved = [name for name, result in results.items() if result is not None]
+    assert len(moved) == 3
+    assert booked(store, SATURDAY) == 30
+    assert booked(store, FRIDAY) == 3 * (len(names) - 3)
+
+
+def test_to_date_day_of_month_rolls_over_to_the_next_month():
+    today = datetime.date(2026, 1, 31)
+    assert to_date(31, today) == datetime.date(2026, 1, 31)
+    assert to_date(30, today) == datetime.date(2026, 3, 30)
+    assert to_date("20261224") == datetime.date(2026, 12, 24)
+    with pytest.raises(ValueError):
+        to_date(32, today)
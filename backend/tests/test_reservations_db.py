@@ -0,0 +1,154 @@
+import datetime
+import threading
+import time
+
+import pytest
+
+from reservations_db import INSERT_RESERVATION, SqliteReservationStore
+
+FRIDAY = datetime.date.today() + datetime.timedelta(days=7)
+SATURDAY = FRIDAY + datetime.timedelta(days=1)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "bookit.db")
+
+
+@pytest.fixture
+def store(path):
+    store = SqliteReservationStore(path, capacity=10)
+    yield store
+    store.close()
+
+
+def hold_writer(store):
+    """Block the writer thread inside a batch until the returned event is set."""
+    entered, release = threading.Event(), threading.Event()
+
+    def wait(conn):
+        entered.set()
+        release.wait(10)
+
+    thread = threading.Thread(target=store._submit, args=(wait,))
+    thread.start()
+    assert entered.wait(10)
+    return release, thread
+
+
+def run_behind_held_batch(store, calls):
+    """Queue `calls` behind a held batch, release it and return each call's result or exception."""
+    release, holder = hold_writer(store)
+    outcome = {}
+
+    def run(name, call):
+        try:
+            outcome[name] = call()
+        except Exception as e:
+            outcome[name] = e
+
+    threads = [threading.Thread(target=run, args=item) for item in calls.items()]
+    for thread in threads:
+        thread.start()
+    while store._writes.qsize() < len(threads):
+        time.sleep(0.001)
+    release.set()
+    for thread in threads + [holder]:
+        thread.join(10)
+    return outcome
+
+
+def record_batches(store, monkeypatch):
+    sizes = []
+    apply = store._apply
+
+    def recording(conn, batch):
+        sizes.append(len(batch))
+        apply(conn, batch)
+
+    monkeypatch.setattr(store, "_apply", recording)
+    return sizes
+
+
+def test_writes_are_persisted_and_shared(path, store):
+    assert store.book(FRIDAY, 4, "Alice").seats == 4
+    assert store.book(FRIDAY, 4, "alice") is None
+    assert store.edit("Alice", FRIDAY, new_date=SATURDAY, seats=6).date == SATURDAY
+    other = SqliteReservationStore(path, capacity=10)
+    try:
+        assert other.find("ALICE", SATURDAY).seats == 6
+        assert (other.available(FRIDAY), other.available(SATURDAY)) == (10, 4)
+        assert other.calendar.free(SATURDAY) == 4
+        assert other.cancel("Alice", SATURDAY).seats == 6
+    finally:
+        other.close()
+    assert store.available(SATURDAY) == 10
+
+
+def test_waiting_writes_are_committed_as_one_batch(store, monkeypatch):
+    sizes = record_batches(store, monkeypatch)
+    names = [f"guest{i}" for i in range(8)]
+    outcome = run_behind_held_batch(store, {name: lambda name=name: store.book(FRIDAY, 2, name) for name in names})
+    # the held batch, then everything that queued up behind it
+    assert sizes == [1, len(names)]
+    # capacity is checked inside the batch: 5 of 8 fit
+    assert sum(outcome[name] is not None for name in names) == 5
+    assert store.available(FRIDAY) == 0
+
+
+def test_failed_operation_is_rolled_back_alone(store, monkeypatch):
+    store.book(FRIDAY, 2, "Alice")
+    sizes = record_batches(store, monkeypatch)
+
+    def failing(conn):
+        # half-done write, then an error: the savepoint must undo it
+        conn.execute(INSERT_RESERVATION, ("zed", FRIDAY.isoformat(), "Zed", 3))
+        raise RuntimeError("boom")
+
+    outcome = run_behind_held_batch(store, {"bob": lambda: store.book(FRIDAY, 3, "Bob"),
+                                            "failing": lambda: store._submit(failing),
+                                            "carol": lambda: store.book(SATURDAY, 4, "Carol")})
+    assert sizes == [1, 3]
+    assert isinstance(outcome["failing"], RuntimeError)
+    assert outcome["bob"].seats == 3 and outcome["carol"].seats == 4
+    assert store.find("Zed", FRIDAY) is None
+    assert store.find("Alice", FRIDAY).seats == 2
+    assert store.available(FRIDAY) == 5
+    assert store.available(SATURDAY) == 6
+
+
+def test_broken_transaction_fails_the_whole_batch(store):
+    store.book(FRIDAY, 2, "Alice")
+
+    def breaks_the_transaction(conn):
+        # ends the batch's transaction, so nothing in the batch can be committed
+        conn.execute("ROLLBACK")
+
+    outcome = run_behind_held_batch(store, {"bob": lambda: store.book(FRIDAY, 3, "Bob"),
+                                            "broken": lambda: store._submit(breaks_the_transaction)})
+    assert isinstance(outcome["bob"], Exception) and isinstance(outcome["broken"], Exception)
+    assert store.find("Bob", FRIDAY) is None
+    assert store.available(FRIDAY) == 8
+    # the writer keeps going after a failed batch
+    assert store.book(FRIDAY, 3, "Bob").seats == 3
+
+
+def test_concurrent_bookings_never_overbook(path, store):
+    other = SqliteReservationStore(path, capacity=10)
+    results = []
+
+    def book(s, name):
+        results.append(s.book(FRIDAY, 3, name))
+
+    try:
+        threads = [threading.Thread(target=book, args=(store if i % 2 else other, f"guest{i}"))
+                   for i in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+    finally:
+        other.close()
+    assert sum(result is not None for result in results) == 3
+    assert store.available(FRIDAY) == 1
+    assert store.nearest_available(FRIDAY, 2, k=1) == [SATURDAY]
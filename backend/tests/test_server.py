@@ -0,0 +1,23 @@
+import pytest
+
+from server import parse_request
+
+
+def test_parse_request():
+    request = parse_request(b'{"session": "abc", "message": "table for 4 on friday", "stream": true}\n')
+    assert request["session"] == "abc" and request["stream"] is True
+    assert parse_request('{"session": 7, "message": "hi"}')["session"] == 7
+
+
+@pytest.mark.parametrize("line, error", [
+    (b"not json", "invalid json"),
+    (b"[1, 2]", "invalid request"),
+    (b"5", "invalid request"),
+    (b'{"session": "abc"}', "invalid request"),
+    (b'{"session": ["abc"], "message": "hi"}', "invalid request"),
+    (b'{"message": "hi"}', "missing session"),
+    (b'{"session": null, "message": "hi"}', "missing session"),
+])
+def test_parse_request_rejects(line, error):
+    with pytest.raises(ValueError, match=error):
+        parse_request(line)